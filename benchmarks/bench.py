@@ -0,0 +1,515 @@
+"""
+字帖生成器性能基准
+
+覆盖主要热点路径，结果写入 JSON 文件，便于在版本之间对比:
+    startup/*   界面启动 (导入 main.py 并显示窗口，期间不应导入绘图引擎) 与后台加载绘图引擎的耗时
+    load/*      StrokeManager.load_data (strokes.txt 文本加载 / strokes.bin 编译库)
+    strokes/*   StrokeManager.draw_char_strokes，简单字与复杂字，几何缓存冷/热两种情况
+    render/*    CopybookGenerator._render_page，A4、A5 与 50×50 自定义网格
+    preview/*   界面预览的刷新延迟: 首次绘制、翻页、改标题、在当前页改一个字 (增量重绘，应低于 100 ms)
+    generate/*  端到端 generate_pdf: 短文本、1千字、5万字 × 全部练习模式 × 左右手
+    parallel/*  多进程并行渲染 (workers > 1)
+    trace/*     GenerationTrace 的各阶段耗时之和应接近总耗时 (没有未计入任何阶段的步骤)
+    stream/*    流式生成的内存: 同一进程由短到长生成几份文本，每页的内存增长与峰值内存的增长都应接近 0
+    animate/*   笔顺动画批量导出 (GIF / APNG / SVG) 的吞吐量: 2千个不同的字，每字一个文件
+
+每个用例在独立子进程中运行，记录的峰值内存 (peak_rss_mb) 只属于该用例。
+
+    python benchmarks/bench.py                                  # 全部用例 (5万字用例耗时很长)
+    python benchmarks/bench.py --sizes short,1k -o result.json  # 跳过 5万字
+    python benchmarks/bench.py --filter render --repeat 3
+    python benchmarks/bench.py --list
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'src')
+
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:
+    HAS_RESOURCE = False
+
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+PRACTICE_MODES = ["笔顺分解", "全描红", "一半描红", "临摹"]
+HAND_MODES = ["right", "left"]
+TEXT_SIZES = {"short": 20, "1k": 1000, "50k": 50000}
+
+# 千字文开头，循环取用生成指定长度的练习文本
+SAMPLE_TEXT = ("天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳"
+               "云腾致雨露结为霜金生丽水玉出昆冈剑号巨阙珠称夜光果珍李柰菜重芥姜"
+               "海咸河淡鳞潜羽翔龙师火帝鸟官人皇始制文字乃服衣裳推位让国有虞陶唐")
+
+# 界面启动时不应导入的模块，由后台线程在窗口显示后再加载
+ENGINE_MODULES = ["generator", "matplotlib", "numpy", "svgpath2mpl", "PIL"]
+
+# 流式内存用例: 全描红每页 15 字，依次约 10 (预热) / 30 / 90 页。
+# 实测 90 页时每页约 1~2 KB，30 页到 90 页峰值增长约 1 MB；每页都有一份字形或图形没释放时每页会多出数十 KB
+STREAM_SIZES = (150, 450, 1350)
+STREAM_KB_PER_PAGE = 16
+STREAM_PEAK_GROWTH_MB = 2
+
+SIMPLE_CHAR = "一"
+COMPLEX_CHAR = "饕"
+
+
+def make_text(n, line_len=40):
+    chars = (SAMPLE_TEXT * (n // len(SAMPLE_TEXT) + 1))[:n]
+    return '\n'.join(chars[i:i + line_len] for i in range(0, n, line_len))
+
+
+def peak_rss_mb(who='self'):
+    """
+    峰值常驻内存 (MB)；who='children' 时为已结束子进程 (并行渲染进程) 中的最大值
+    """
+    if HAS_RESOURCE:
+        usage = resource.RUSAGE_CHILDREN if who == 'children' else resource.RUSAGE_SELF
+        peak = resource.getrusage(usage).ru_maxrss
+        # Linux 单位为 KB，macOS 为字节
+        return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+    if HAS_PSUTIL and who == 'self':
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / 1024 / 1024, 1)
+    return None
+
+
+def _timed(func, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None: setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {"seconds": round(statistics.median(times), 6), "min_seconds": round(min(times), 6),
+            "repeat": repeat}
+
+
+# ==========================================
+# 用例定义 (在子进程中执行)
+# ==========================================
+def case_startup_gui(args):
+    """
+    导入 main.py 的耗时；有显示器时加上创建窗口并完成首次绘制的耗时。
+    导入后若已加载绘图引擎 (ENGINE_MODULES) 视为启动变慢的回归，记为错误
+    """
+    start = time.perf_counter()
+    import main
+    result = {"import_seconds": round(time.perf_counter() - start, 6), "repeat": 1}
+    loaded = [m for m in ENGINE_MODULES if m in sys.modules]
+    if loaded:
+        return {"error": f"界面启动时导入了 {', '.join(loaded)}"}
+
+    import tkinter as tk
+    try: root = tk.Tk()
+    except tk.TclError:
+        result['seconds'] = result['import_seconds']
+        result['window_seconds'] = None   # 没有显示器 (如 CI)，只计导入
+        return result
+    window_start = time.perf_counter()
+    main.App(root)
+    root.update()
+    result['window_seconds'] = round(time.perf_counter() - window_start, 6)
+    result['seconds'] = round(result['import_seconds'] + result['window_seconds'], 6)
+    root.destroy()
+    return result
+
+
+def case_startup_engine(args):
+    """
+    界面后台线程所做的工作: 导入 generator.py、创建生成器并加载笔顺数据
+    """
+    start = time.perf_counter()
+    from generator import CopybookGenerator
+    import_seconds = time.perf_counter() - start
+    CopybookGenerator().stroke_mgr.load_data()
+    return {"seconds": round(time.perf_counter() - start, 6), "repeat": 1,
+            "import_seconds": round(import_seconds, 6)}
+
+
+def _base_params(generator, font):
+    from generator import DEFAULT_PARAMS, GRID_COLORS
+    params = dict(DEFAULT_PARAMS)
+    params['grid_color'] = GRID_COLORS.get(params['grid_color'], params['grid_color'])
+    params['font_path'] = font or generator.default_font_path()
+    return params
+
+
+def case_load(generator, args, source):
+    mgr = generator.stroke_mgr
+    if source == 'txt':
+        mgr.store_path = os.path.join(tempfile.gettempdir(), 'no-such-strokes.bin')
+    elif not os.path.exists(mgr.store_path):
+        return {"skipped": "未找到 strokes.bin"}
+    start = time.perf_counter()
+    mgr.load_data()
+    result = {"seconds": round(time.perf_counter() - start, 6), "repeat": 1,
+              "loaded": mgr.loaded, "chars": len(mgr.store) if mgr.store is not None else len(mgr.char_data)}
+    return result
+
+
+def case_strokes(generator, args, char, warm):
+    import matplotlib.pyplot as plt
+    mgr = generator.stroke_mgr
+    mgr.load_data()
+    if not mgr.get_strokes(char):
+        return {"skipped": f"缺少 {char} 的笔顺数据"}
+    fig, ax = plt.subplots(figsize=(1, 1))
+    n_calls = 100
+    if warm: mgr.get_geometry(char)
+
+    def run():
+        for _ in range(n_calls):
+            if not warm: mgr.clear_cache()
+            mgr.draw_char_strokes(ax, char, 0, 0, 1.0)
+
+    # 每轮前清空坐标轴，避免补丁越积越多
+    result = _timed(run, args.repeat, setup=ax.cla)
+    result['calls_per_repeat'] = n_calls
+    result['strokes'] = mgr.stroke_count(char)
+    plt.close(fig)
+    return result
+
+
+def case_render(generator, args, paper):
+    import io
+    from generator import _pdf_font_type
+    params = _base_params(generator, args.font)
+    params['text'] = make_text(TEXT_SIZES['1k'])
+    params['fill_page'] = True
+    if paper == '50x50':
+        params.update(paper_size="自定义", custom_rows=50, custom_cols=50)
+    else:
+        params['paper_size'] = paper
+    generator.stroke_mgr.load_data()
+    config = generator.get_layout_config(params)
+    grid_map = next(iter(generator.layout_pages(params, config)))
+
+    figs = []
+    result = _timed(lambda: figs.append(generator._render_page(config, params, grid_map, 1)), args.repeat)
+    # 顺带记录单页 savefig 的耗时
+    buf = io.BytesIO()
+    start = time.perf_counter()
+    with _pdf_font_type(params.get('pdf_fonttype', 3)):
+        figs[-1].savefig(buf, format='pdf', bbox_inches='tight', pad_inches=0)
+    result['savefig_seconds'] = round(time.perf_counter() - start, 6)
+    result['page_bytes'] = buf.tell()
+    return result
+
+
+def case_preview(generator, args, mode):
+    """
+    界面预览的刷新延迟 (与 PreviewPane.refresh 相同: 排版到当前页 + PagePainter 增量绘制，A4 预览分辨率):
+    首次绘制、翻页、改标题与在本页改一个字。改一个字的刷新超过 100 ms 时报错
+    """
+    import itertools
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from preview import PagePainter, PreviewPane
+    params = _base_params(generator, args.font)
+    params.update(text=make_text(TEXT_SIZES['1k']), practice_mode=mode, is_multipage=True, fill_page=False)
+    generator.stroke_mgr.load_data()
+    config = generator.get_layout_config(params)
+    fig = Figure(figsize=(config['width'], config['height']), dpi=PreviewPane.PREVIEW_DPI)
+    FigureCanvasAgg(fig)
+    painter = PagePainter(generator, fig)
+
+    def refresh(p, page_index=0):
+        start = time.perf_counter()
+        grid_map = next(itertools.islice(generator.layout_pages(p, config), page_index, None))
+        cells = painter.paint(config, p, generator.get_page_template(config, p), grid_map, page_index + 1)
+        return time.perf_counter() - start, cells
+
+    result = {}
+    result['first_seconds'] = round(refresh(params)[0], 6)
+    result['page_seconds'] = round(refresh(params, 1)[0], 6)
+    refresh(params)
+    result['title_seconds'] = round(refresh(dict(params, custom_title="预览"))[0], 6)
+    # 第 6 个字换成另一个字，两种文本交替刷新 (各自先刷新一次，字形与笔画缓存已热)
+    text = params['text']
+    edits = [dict(params, text=text[:5] + ch + text[6:]) for ch in (SIMPLE_CHAR, COMPLEX_CHAR)]
+    for p in edits: refresh(p)
+    times = []
+    for i in range(max(2, args.repeat)):
+        seconds, cells = refresh(edits[i % 2])
+        times.append(seconds)
+    result.update(seconds=round(statistics.median(times), 6), min_seconds=round(min(times), 6),
+                  repeat=len(times), edit_cells=cells)
+    if result['seconds'] > 0.1:
+        result['error'] = f"改一个字后刷新预览用了 {result['seconds'] * 1000:.0f} ms (应低于 100 ms)"
+    return result
+
+
+def case_generate(generator, args, size, mode, hand, workers=1):
+    params = _base_params(generator, args.font)
+    params.update(text=make_text(TEXT_SIZES[size]), practice_mode=mode, hand_mode=hand,
+                  is_multipage=True, fill_page=False, backend=args.backend, workers=workers)
+    out_dir = tempfile.mkdtemp(prefix='copybook-bench-')
+    try:
+        params['output_file'] = os.path.join(out_dir, 'bench.pdf')
+        start = time.perf_counter()
+        generator.generate_pdf(params)
+        seconds = time.perf_counter() - start
+        pages = generator.dry_run(params, include_cells=False)['page_count']
+        return {"seconds": round(seconds, 6), "repeat": 1, "pages": pages,
+                "pdf_bytes": os.path.getsize(params['output_file']),
+                "seconds_per_page": round(seconds / pages, 6) if pages else None}
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def case_trace_stages(generator, args, mode):
+    """
+    带 GenerationTrace 生成 1 千字: 各阶段 (含 finalize) 之和与总耗时相差超过 10% 时报错
+    """
+    from generator import GenerationTrace
+    params = _base_params(generator, args.font)
+    params.update(text=make_text(TEXT_SIZES['1k']), practice_mode=mode, is_multipage=True, fill_page=False,
+                  backend=args.backend)
+    out_dir = tempfile.mkdtemp(prefix='copybook-bench-')
+    try:
+        params['output_file'] = os.path.join(out_dir, 'bench.pdf')
+        trace = GenerationTrace()
+        generator.generate_pdf(params, trace=trace)
+        summary = trace.summary
+        staged = sum(summary['stages'].values())
+        result = {"seconds": summary['total_seconds'], "repeat": 1, "staged_seconds": round(staged, 6),
+                  "stages": summary['stages'], "finalize_bytes": summary['finalize_bytes']}
+        unaccounted = summary['total_seconds'] - staged
+        result['unaccounted_seconds'] = round(unaccounted, 6)
+        if abs(unaccounted) > 0.1 * summary['total_seconds']:
+            result['error'] = f"有 {unaccounted:.2f}s 未计入任何阶段"
+        return result
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def current_rss_mb():
+    """
+    当前常驻内存 (MB)；取不到时为 None
+    """
+    if HAS_PSUTIL:
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def case_stream_memory(generator, args, sizes):
+    """
+    流式模式从文本文件逐块读取并逐页写出 (带进度回调，与界面相同)，同一进程中由短到长生成几份文本，
+    记录每份之后的峰值内存，并在每页写出时采样常驻内存。最短一份用于预热 (笔顺、字形与版式缓存在此填充)。
+    最长一份去掉前 1/4 页后拟合内存随页数的斜率，超过 STREAM_KB_PER_PAGE 视为每页都有内存没有释放；
+    峰值内存在预热之后的第一份与最长一份之间增长超过 STREAM_PEAK_GROWTH_MB 也报错
+    """
+    if current_rss_mb() is None:
+        return {"skipped": "无法读取当前内存 (需要 psutil 或 /proc)"}
+    import numpy as np
+    out_dir = tempfile.mkdtemp(prefix='copybook-bench-')
+    try:
+        result = {"repeat": 1, "runs": []}
+        for n in sizes:
+            text_file = os.path.join(out_dir, f'{n}.txt')
+            with open(text_file, 'w', encoding='utf-8') as f:
+                f.write(make_text(n))
+            params = _base_params(generator, args.font)
+            params.update(practice_mode="全描红", is_multipage=True, fill_page=False, backend=args.backend,
+                          streaming=True, output_file=os.path.join(out_dir, f'{n}.pdf'))
+            samples = []
+            with open(text_file, 'r', encoding='utf-8') as f:
+                params['text'] = f
+                start = time.perf_counter()
+                generator.generate_pdf(params, progress=lambda stage, done, total:
+                                       samples.append(current_rss_mb()) if stage == 'write' else None)
+            run = {"chars": n, "pages": len(samples), "seconds": round(time.perf_counter() - start, 6),
+                   "peak_rss_mb": peak_rss_mb(), "rss_mb_first_last": [round(samples[0], 1), round(samples[-1], 1)]}
+            skip = len(samples) // 4
+            if len(samples) - skip >= 8:
+                slope = np.polyfit(np.arange(skip, len(samples)), samples[skip:], 1)[0]
+                run['kb_per_page'] = round(slope * 1024, 1)
+            result['runs'].append(run)
+        last = result['runs'][-1]
+        result['seconds'] = sum(r['seconds'] for r in result['runs'])
+        result['kb_per_page'] = last.get('kb_per_page')
+        growth = last['peak_rss_mb'] - result['runs'][1]['peak_rss_mb']
+        result['peak_growth_mb'] = round(growth, 1)
+        errors = []
+        if result['kb_per_page'] is not None and result['kb_per_page'] > STREAM_KB_PER_PAGE:
+            errors.append(f"{last['pages']} 页中每页内存增长 {result['kb_per_page']:.1f} KB")
+        if growth > STREAM_PEAK_GROWTH_MB:
+            errors.append(f"峰值内存随文本长度增长了 {growth:.1f} MB")
+        if errors: result['error'] = "；".join(errors)
+        return result
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def case_animate(generator, args, fmt, n):
+    """
+    从 U+4E00 起取前 n 个有笔顺数据的不同字，批量导出动画，记录吞吐量 (字/秒)
+    """
+    from animation import export_animations
+    mgr = generator.stroke_mgr
+    mgr.load_data()
+    chars = []
+    code = 0x4E00
+    while len(chars) < n and code <= 0x9FFF:
+        if mgr.stroke_count(chr(code)): chars.append(chr(code))
+        code += 1
+    if not chars:
+        return {"skipped": "没有笔顺数据"}
+    out_dir = tempfile.mkdtemp(prefix='copybook-bench-')
+    try:
+        stats = export_animations(mgr, chars, out_dir, fmt)
+        return {"seconds": stats['seconds'], "repeat": 1, "chars": len(stats['files']), "frames": stats['frames'],
+                "chars_per_second": stats['chars_per_second'],
+                "bytes": sum(os.path.getsize(p) for p in stats['files'])}
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def all_cases(sizes, workers):
+    cases = [("startup/gui", case_startup_gui, ()), ("startup/engine", case_startup_engine, ()),
+             ("load/txt", case_load, ("txt",)), ("load/store", case_load, ("store",))]
+    for char in (SIMPLE_CHAR, COMPLEX_CHAR):
+        for warm in (False, True):
+            cases.append((f"strokes/{char}/{'warm' if warm else 'cold'}", case_strokes, (char, warm)))
+    for paper in ("A4", "A5", "50x50"):
+        cases.append((f"render/{paper}", case_render, (paper,)))
+    for mode in PRACTICE_MODES:
+        cases.append((f"preview/A4/{mode}", case_preview, (mode,)))
+    for size in sizes:
+        for mode in PRACTICE_MODES:
+            for hand in HAND_MODES:
+                cases.append((f"generate/{size}/{mode}/{hand}", case_generate, (size, mode, hand)))
+    if workers > 1:
+        cases.append((f"parallel/1k/笔顺分解/workers={workers}", case_generate, ("1k", "笔顺分解", "right", workers)))
+    for mode in ("全描红", "笔顺分解"):
+        cases.append((f"trace/1k/{mode}", case_trace_stages, (mode,)))
+    cases.append(("stream/memory-per-page", case_stream_memory, (STREAM_SIZES,)))
+    for fmt in ("gif", "apng", "svg"):
+        cases.append((f"animate/{fmt}/2k", case_animate, (fmt, 2000)))
+    return cases
+
+
+def run_case(args):
+    sys.path.insert(0, SRC_DIR)
+    import warnings
+    warnings.filterwarnings('ignore')
+
+    name = args.run_case
+    cases = {n: (f, a) for n, f, a in all_cases(list(TEXT_SIZES), args.workers)}
+    func, case_args = cases[name]
+    try:
+        if name.startswith('startup/'):
+            # 启动用例自己计时导入过程，不能事先导入 generator
+            result = func(args, *case_args)
+        else:
+            from generator import CopybookGenerator
+            generator = CopybookGenerator()
+            result = func(generator, args, *case_args)
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+    result['name'] = name
+    result['peak_rss_mb'] = peak_rss_mb()
+    if args.workers > 1 and name.startswith('parallel/'):
+        result['peak_rss_worker_mb'] = peak_rss_mb('children')
+    # 最后一行输出 JSON 结果，供父进程读取
+    print(json.dumps(result, ensure_ascii=False))
+
+
+# ==========================================
+# 父进程: 逐个启动用例并汇总
+# ==========================================
+def collect_meta(args):
+    import matplotlib
+    import numpy
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "matplotlib": matplotlib.__version__,
+        "numpy": numpy.__version__,
+        "backend": args.backend,
+        "repeat": args.repeat
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="字帖生成器性能基准")
+    parser.add_argument('-o', '--output', default='bench_results.json', help="结果 JSON 文件")
+    parser.add_argument('--filter', action='append', help="只运行名称包含该字符串的用例，可重复")
+    parser.add_argument('--sizes', default=','.join(TEXT_SIZES), help="端到端用例的文本规模 (默认 short,1k,50k)")
+    parser.add_argument('--repeat', type=int, default=5, help="微基准重复次数，取中位数")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="并行用例的进程数")
+    parser.add_argument('--backend', default='matplotlib', choices=['matplotlib', 'pdf'], help="端到端用例的输出后端")
+    parser.add_argument('--font', default='', help="字体文件 (默认 resources/simkai.ttf)")
+    parser.add_argument('--list', action='store_true', help="只列出用例名称")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        run_case(args)
+        return 0
+
+    sizes = [s for s in args.sizes.split(',') if s]
+    for s in sizes:
+        if s not in TEXT_SIZES: parser.error(f"未知的文本规模: {s}")
+    cases = [name for name, _, _ in all_cases(sizes, args.workers)]
+    if args.filter:
+        cases = [name for name in cases if any(f in name for f in args.filter)]
+    if args.list:
+        print('\n'.join(cases))
+        return 0
+
+    results = []
+    for i, name in enumerate(cases, 1):
+        cmd = [sys.executable, os.path.abspath(__file__), '--run-case', name,
+               '--repeat', str(args.repeat), '--workers', str(args.workers),
+               '--backend', args.backend, '--font', args.font]
+        proc = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8')
+        try:
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            result = {"name": name, "error": (proc.stderr.strip().splitlines() or ["子进程无输出"])[-1]}
+        results.append(result)
+
+        if 'error' in result: status = f"错误: {result['error']}"
+        elif 'skipped' in result: status = f"跳过: {result['skipped']}"
+        else:
+            status = f"{result['seconds']:.4f}s  峰值内存 {result['peak_rss_mb']} MB"
+            if 'pdf_bytes' in result: status += f"  {result['pages']} 页  {result['pdf_bytes'] / 1024:.0f} KB"
+            if 'peak_growth_mb' in result: status += f"  (每页 {result['kb_per_page']} KB，峰值增长 {result['peak_growth_mb']} MB)"
+        print(f"[{i}/{len(cases)}] {name}  {status}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({"meta": collect_meta(args), "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+    return 0 if all('error' not in r for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
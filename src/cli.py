@@ -0,0 +1,337 @@
+"""
+字帖生成器命令行入口 (无界面)
+
+参数与界面生成时使用的 params 完全一致，未给出的项取 DEFAULT_PARAMS。
+
+    # 单个任务: 参数文件 + 命令行覆盖
+    python src/cli.py generate -o 字帖.pdf --text "天地玄黄" --set practice_mode=临摹
+    python src/cli.py generate -o 字帖.tiff --text-file 课文.txt --set is_multipage=true --set raster_dpi=600
+    python src/cli.py generate -o 字帖.pdf --params job.json --text-file 课文.txt
+
+    # 记录逐页、逐阶段耗时，并用 cProfile 分析第 3 页
+    python src/cli.py generate -o 字帖.pdf --text-file 课文.txt --trace trace.json --profile-page 3
+
+    # 启用页面缓存: 再次生成时只重新渲染内容有变化的页
+    python src/cli.py generate -o 字帖.pdf --text-file 课文.txt --set is_multipage=true --page-cache
+
+    # 批量任务: JSON 或 CSV 清单，所有任务在同一进程中运行，笔顺数据与字体只加载一次
+    python src/cli.py batch jobs.json --output-dir out/ --report report.json
+
+    # 流式生成很长的文本: 边读文件边排版，逐页写出，内存占用与文本长度无关
+    python src/cli.py generate -o 全文.pdf --text-file 长篇.txt --set is_multipage=true --stream
+
+    # 导出笔顺动画: 每个字一个文件 (GIF / APNG / 动画 SVG)，供课堂投屏
+    python src/cli.py animate --text-file 课文.txt -o 动画/ --format gif --frame-ms 300
+
+    # 只排版不绘图，估算页数
+    python src/cli.py dry-run --text-file 课文.txt --set is_multipage=true
+
+    # 本地 HTTP 服务: POST /generate 提交 params JSON 返回 PDF，GET /metrics 查看延迟与吞吐
+    python src/cli.py serve --port 8000 --workers 2 --queue 8
+
+    # 查看 PDF 中嵌入字体的大小 (需要 pypdf)
+    python src/cli.py fonts 字帖.pdf
+
+    # 编译笔顺库
+    python src/cli.py build-store
+
+JSON 清单可以是任务列表，也可以是 {"defaults": {...}, "jobs": [...]}；
+CSV 清单首行为参数名。任务中的 text_file 相对于清单所在目录，
+相对的 output_file 相对于 --output-dir (默认同样是清单所在目录)。
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from generator import CopybookGenerator, GenerationTrace, DEFAULT_PARAMS, GRID_COLORS, embedded_font_sizes
+from stroke_store import build_stroke_store, STORE_FILENAME
+from page_cache import PageCache, DEFAULT_CACHE_DIR
+from animation import export_animations, ANIMATION_FORMATS
+
+
+def _convert(key, value):
+    """
+    把字符串形式的参数值 (命令行 --set、CSV 单元格) 按默认值的类型转换
+    """
+    if not isinstance(value, str): return value
+    default = DEFAULT_PARAMS.get(key)
+    if isinstance(default, bool):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y', '是')
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+
+def _stream_text_file(path, chunk_size=64 * 1024):
+    """
+    分块读取文本文件，结果与 f.read().strip() 相同: 去掉开头的空白，
+    每块末尾的空白暂存，后面还有内容时才输出
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        pending = None
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk: return
+            if pending is None:
+                chunk = chunk.lstrip()
+                if not chunk: continue
+                pending = ''
+            body = chunk.rstrip()
+            if body:
+                yield pending + body
+                pending = chunk[len(body):]
+            else:
+                pending += chunk
+
+
+def build_params(job, generator, base_dir='.', output_dir=None):
+    """
+    补全任务参数: 默认值、颜色名称、默认字体、text_file 与相对路径
+    """
+    params = dict(DEFAULT_PARAMS)
+    for key, value in job.items():
+        if value is None or value == '': continue
+        params[key] = _convert(key, value)
+
+    params['grid_color'] = GRID_COLORS.get(params['grid_color'], params['grid_color'])
+    if not params['font_path']:
+        params['font_path'] = generator.default_font_path()
+
+    text_file = params.pop('text_file', None)
+    if text_file and params.get('streaming') and params['is_multipage']:
+        # 流式模式不把整个文件读入内存，生成时再逐块读取
+        params['text'] = _stream_text_file(os.path.join(base_dir, text_file))
+    else:
+        if text_file:
+            with open(os.path.join(base_dir, text_file), 'r', encoding='utf-8') as f:
+                params['text'] = f.read()
+        params['text'] = params['text'].strip()
+
+    if params.get('output_file'):
+        params['output_file'] = os.path.join(output_dir or base_dir, params['output_file'])
+    # 与界面一致: 多页模式下不循环填满
+    if params['is_multipage']: params['fill_page'] = False
+    return params
+
+
+def load_manifest(path):
+    if path.lower().endswith('.csv'):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            return {}, list(csv.DictReader(f))
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return data.get('defaults', {}), data.get('jobs', [])
+    return {}, data
+
+
+def run_jobs(generator, jobs, base_dir='.', output_dir=None, out=sys.stdout, trace=None):
+    """
+    顺序执行任务，返回每个任务的耗时与结果
+    trace: 可选的 GenerationTrace (只适合单个任务)
+    """
+    results = []
+    total_start = time.perf_counter()
+    for i, job in enumerate(jobs, 1):
+        start = time.perf_counter()
+        entry = {"index": i, "output_file": None, "ok": False}
+        try:
+            params = build_params(job, generator, base_dir, output_dir)
+            if not params.get('output_file'):
+                raise ValueError("缺少 output_file")
+            entry['output_file'] = params['output_file']
+            generator.generate_pdf(params, trace=trace)
+            entry['ok'] = True
+            # 多页 PNG 按页编号输出，没有与 output_file 同名的文件
+            if os.path.exists(params['output_file']):
+                entry['bytes'] = os.path.getsize(params['output_file'])
+        except Exception as e:
+            entry['error'] = str(e)
+        entry['seconds'] = round(time.perf_counter() - start, 4)
+        results.append(entry)
+        status = "完成" if entry['ok'] else f"失败: {entry['error']}"
+        print(f"[{i}/{len(jobs)}] {entry['output_file'] or '-'}  {entry['seconds']:.2f}s  {status}", file=out)
+
+    total = time.perf_counter() - total_start
+    done = sum(1 for r in results if r['ok'])
+    summary = {
+        "jobs": len(jobs), "succeeded": done, "failed": len(jobs) - done,
+        "total_seconds": round(total, 4),
+        "jobs_per_minute": round(done / total * 60, 2) if total > 0 else 0.0
+    }
+    print(f"共 {len(jobs)} 个任务，成功 {done} 个，总耗时 {total:.2f}s，"
+          f"吞吐 {summary['jobs_per_minute']} 个/分钟", file=out)
+    return results, summary
+
+
+def _job_from_args(args):
+    job = {}
+    if args.params:
+        with open(args.params, 'r', encoding='utf-8') as f:
+            job.update(json.load(f))
+    for item in args.set or []:
+        key, _, value = item.partition('=')
+        job[key.strip()] = value
+    if args.text is not None: job['text'] = args.text
+    if args.text_file: job['text_file'] = os.path.abspath(args.text_file)
+    return job
+
+
+def _print_cache_stats(page_cache):
+    if page_cache is None: return
+    stats = page_cache.stats()
+    rate = f"{stats['hit_rate']:.0%}" if stats['hit_rate'] is not None else "-"
+    print(f"页面缓存: 命中 {stats['hits']} / 未命中 {stats['misses']} (命中率 {rate})，"
+          f"{stats['entries']} 页 {stats['bytes'] / 1024 / 1024:.1f} MB，淘汰 {stats['evictions']} 页")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="汉字字帖生成器 (命令行)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def add_job_args(p):
+        p.add_argument('--params', help="JSON 参数文件 (与界面生成的 params 相同)")
+        p.add_argument('--text', help="练习内容")
+        p.add_argument('--text-file', help="从 UTF-8 文本文件读取练习内容")
+        p.add_argument('--set', action='append', metavar='KEY=VALUE', help="覆盖单个参数，可重复")
+
+    def add_cache_args(p):
+        p.add_argument('--page-cache', nargs='?', const=DEFAULT_CACHE_DIR, metavar='DIR',
+                       help=f"启用页面缓存，只重新渲染内容变化的页 (默认目录 {DEFAULT_CACHE_DIR})")
+        p.add_argument('--page-cache-mb', type=int, default=256, help="页面缓存大小上限 (MB)")
+
+    p_gen = sub.add_parser('generate', help="生成单个字帖")
+    add_job_args(p_gen)
+    p_gen.add_argument('-o', '--output', required=True, help="输出路径，按扩展名输出 PDF、PNG 或多页 TIFF")
+    p_gen.add_argument('--stream', action='store_true',
+                       help="流式生成 (多页模式): 逐块读取文本、逐页写出，内存占用与文本长度无关")
+    p_gen.add_argument('--trace', help="把逐页、逐阶段的耗时与计数写入 JSON 文件")
+    p_gen.add_argument('--profile-page', type=int, help="用 cProfile 分析第 N 页的绘制与写入")
+    p_gen.add_argument('--profile-out', help="cProfile 统计文件 (默认 <输出>.prof)")
+    add_cache_args(p_gen)
+
+    p_batch = sub.add_parser('batch', help="按 JSON/CSV 清单批量生成")
+    p_batch.add_argument('manifest')
+    p_batch.add_argument('--output-dir', help="相对输出路径的根目录 (默认为清单所在目录)")
+    p_batch.add_argument('--report', help="把逐个任务的耗时写入 JSON 文件")
+    add_cache_args(p_batch)
+
+    p_anim = sub.add_parser('animate', help="导出笔顺动画，每个字一个文件")
+    p_anim.add_argument('--text', help="要导出的字")
+    p_anim.add_argument('--text-file', help="从 UTF-8 文本文件读取要导出的字")
+    p_anim.add_argument('-o', '--output-dir', required=True, help="输出目录")
+    p_anim.add_argument('--format', choices=ANIMATION_FORMATS, default='gif')
+    p_anim.add_argument('--size', type=int, default=256, help="动画边长 (像素)")
+    p_anim.add_argument('--frame-ms', type=int, default=400, help="每一笔停留的毫秒数")
+    p_anim.add_argument('--hold-ms', type=int, default=1200, help="写完后停留的毫秒数")
+    p_anim.add_argument('--grid-style', default=DEFAULT_PARAMS['grid_style'], help="米字格 / 田字格 / 其他为方格")
+    p_anim.add_argument('--grid-color', default=DEFAULT_PARAMS['grid_color'], help="网格颜色 (颜色名或 #RRGGBB)")
+    p_anim.add_argument('--no-outline', action='store_true', help="不画浅色整字轮廓")
+
+    p_dry = sub.add_parser('dry-run', help="只排版不绘图，输出页数与缺少笔顺的字")
+    add_job_args(p_dry)
+
+    p_serve = sub.add_parser('serve', help="启动本地 HTTP 生成服务")
+    p_serve.add_argument('--host', default='127.0.0.1')
+    p_serve.add_argument('--port', type=int, default=8000)
+    p_serve.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="常驻工作进程数")
+    p_serve.add_argument('--queue', type=int, default=8, help="排队上限，超出时返回 503")
+    p_serve.add_argument('--timeout', type=float, default=120, help="单个请求的生成超时 (秒)")
+
+    p_fonts = sub.add_parser('fonts', help="列出 PDF 中嵌入字体的大小")
+    p_fonts.add_argument('pdf', nargs='+')
+
+    sub.add_parser('build-store', help=f"把 strokes.txt 编译为 {STORE_FILENAME}")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        from server import serve
+        serve(args.host, args.port, args.workers, args.queue, args.timeout)
+        return 0
+
+    if args.command == 'fonts':
+        for pdf_file in args.pdf:
+            sizes = embedded_font_sizes(pdf_file)
+            if sizes is None:
+                print(f"{pdf_file}: 无法读取 (需要安装 pypdf)")
+                continue
+            print(f"{pdf_file}: 文件 {os.path.getsize(pdf_file) / 1024:.1f} KB，嵌入字体 {sum(sizes.values()) / 1024:.1f} KB")
+            for name, n in sorted(sizes.items()):
+                print(f"    {name}  {n / 1024:.1f} KB")
+        return 0
+
+    page_cache = None
+    if getattr(args, 'page_cache', None):
+        page_cache = PageCache(args.page_cache, args.page_cache_mb * 1024 * 1024)
+    generator = CopybookGenerator(page_cache=page_cache)
+
+    if args.command == 'build-store':
+        txt_path = os.path.join(generator.resource_dir, 'strokes.txt')
+        store_path = os.path.join(generator.resource_dir, STORE_FILENAME)
+        n = build_stroke_store(txt_path, store_path)
+        print(f"已编译 {n} 个字 -> {store_path}")
+        return 0
+
+    if args.command == 'animate':
+        if args.text_file:
+            with open(args.text_file, 'r', encoding='utf-8') as f:
+                text = f.read()
+        else:
+            text = args.text or ''
+        result = export_animations(
+            generator.stroke_mgr, text, args.output_dir, args.format,
+            size=args.size, frame_ms=args.frame_ms, hold_ms=args.hold_ms, grid_style=args.grid_style,
+            grid_color=GRID_COLORS.get(args.grid_color, args.grid_color),
+            outline_color=None if args.no_outline else '#D3D3D3')
+        print(f"已导出 {len(result['files'])} 个字，共 {result['frames']} 帧 -> {args.output_dir}  "
+              f"耗时 {result['seconds']:.2f}s，{result['chars_per_second']} 字/秒")
+        if result['missing']: print(f"缺少笔顺的字: {''.join(result['missing'])}")
+        return 0
+
+    if args.command == 'dry-run':
+        params = build_params(_job_from_args(args), generator)
+        result = generator.dry_run(params, include_cells=False)
+        result.pop('pages')
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+
+    if args.command == 'generate':
+        job = _job_from_args(args)
+        job['output_file'] = os.path.abspath(args.output)
+        if args.stream: job['streaming'] = True
+        trace = None
+        if args.trace or args.profile_page:
+            profile_out = args.profile_out or (job['output_file'] + '.prof' if args.profile_page else None)
+            trace = GenerationTrace(json_path=args.trace, profile_page=args.profile_page, profile_path=profile_out)
+        results, _ = run_jobs(generator, [job], trace=trace)
+        if trace is not None and trace.summary is not None:
+            summary = trace.summary
+            stages = '  '.join(f"{k} {v:.2f}s" for k, v in summary['stages'].items())
+            print(f"{summary['pages']} 页  {stages}  缓存命中 {summary['cache_hits']} / 未命中 {summary['cache_misses']}")
+            if 'font_bytes' in summary: print(f"嵌入字体 {summary['font_bytes'] / 1024:.1f} KB ({len(summary['fonts'])} 个)")
+            if trace.profile_text: print(f"第 {args.profile_page} 页的 cProfile 统计: {profile_out}")
+        _print_cache_stats(page_cache)
+        return 0 if results[0]['ok'] else 1
+
+    defaults, jobs = load_manifest(args.manifest)
+    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    if args.output_dir: os.makedirs(args.output_dir, exist_ok=True)
+    jobs = [dict(defaults, **job) for job in jobs]
+    results, summary = run_jobs(generator, jobs, base_dir, args.output_dir)
+    _print_cache_stats(page_cache)
+    if page_cache is not None: summary['page_cache'] = page_cache.stats()
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({"summary": summary, "jobs": results}, f, ensure_ascii=False, indent=2)
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
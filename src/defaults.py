@@ -0,0 +1,36 @@
+"""
+字帖参数的默认值与网格颜色表
+
+只含普通数据、不导入任何绘图库，界面启动时可以直接使用，不必等待 generator.py 加载 matplotlib
+"""
+
+# 网格颜色名称与色值
+GRID_COLORS = {"粉色": "#FFB6C1", "红色": "#FF0000", "灰色": "#A9A9A9", "黑色": "#000000"}
+
+# generate_pdf 参数的默认值，与界面默认设置一致 (命令行与批量模式据此补全参数)
+DEFAULT_PARAMS = {
+    "text": "",
+    "font_path": "",
+    "paper_size": "A4",
+    "hand_mode": "right",
+    "grid_style": "米字格",
+    "grid_color": GRID_COLORS["粉色"],
+    "practice_mode": "笔顺分解",
+    "fill_page": True,
+    "is_multipage": False,
+    "title_every_page": True,
+    "stroke_rest_mode": "trace",
+    "has_title": True,
+    "custom_title": "汉字练习",
+    "align_mode": "top",
+    "custom_rows": 10,
+    "custom_cols": 12,
+    "grid_size_type": "auto",
+    "grid_size_val": 0.0,
+    "backend": "matplotlib",
+    "workers": 1,
+    "output_format": "auto",    # auto (按扩展名) / pdf / png / tiff
+    "raster_dpi": 300,
+    "pdf_fonttype": 3,          # PDF 字体嵌入: 3 (默认，保存快) / 42 (TrueType 子集，保存时子集化较慢)
+    "streaming": False,         # 流式生成: text 可为文件或迭代器，逐页排版写出，内存占用与文本长度无关
+}
@@ -1,14 +1,33 @@
-import matplotlib.pyplot as plt
+import matplotlib
 import matplotlib.patches as patches
-from matplotlib.font_manager import FontProperties
+from matplotlib.font_manager import FontProperties, findfont, get_font
 from matplotlib.path import Path
-from matplotlib.transforms import Affine2D, Bbox
+from matplotlib.collections import LineCollection, PolyCollection, PathCollection
+from matplotlib.transforms import Affine2D, AffineDeltaTransform, Bbox, IdentityTransform
+from matplotlib.textpath import TextPath
 from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image, TiffImagePlugin
 import os
+import io
 import math
 import json
+import hashlib
+import time
+import cProfile
+import pstats
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
 import numpy as np
 
+from stroke_store import CompiledStrokeStore, STORE_FILENAME
+from pdf_writer import PdfDocument, PdfContent
+# 参数默认值在不依赖绘图库的 defaults.py 中 (界面启动时只导入它)，这里一并导出
+from defaults import GRID_COLORS, DEFAULT_PARAMS
+
 # 检查依赖
 try:
     from svgpath2mpl import parse_path
@@ -17,99 +36,1330 @@ except ImportError:
     HAS_SVG_LIB = False
     print("提示: 未安装 svgpath2mpl，无法显示笔顺")
 
+# 可选依赖: 并行生成时用于按页序合并各进程输出的 PDF，也用于统计嵌入字体的大小
+try:
+    from pypdf import PdfReader, PdfWriter
+    HAS_PYPDF = True
+except ImportError:
+    HAS_PYPDF = False
+
+RASTER_FORMATS = {'.png': 'png', '.tif': 'tiff', '.tiff': 'tiff'}
+
+# PDF 字体嵌入方式 (params['pdf_fonttype'])，两种都只嵌入用到的字形:
+#   3  每个字形写成一段绘图过程 (默认)，保存快
+#   42 TrueType 子集，文字可选中、打印有 hinting，但每份 PDF 关闭时要用 fontTools 子集化，单页保存慢 2~3 倍
+# 只在本模块写 PDF 期间生效 (见 _pdf_font_type)，不改动宿主程序中其他 matplotlib 代码的设置
+PDF_FONTTYPES = (3, 42)
+
+# 多进程并行时每个进程至少分到的页数: 工作进程启动 (导入 matplotlib、加载笔顺数据) 约相当于渲染两页，
+# 页数太少时并行只会更慢
+PARALLEL_MIN_PAGES = 4
+
+# 页面缓存: 页面渲染方式变化时递增版本号，使旧缓存全部失效
+PAGE_CACHE_VERSION = 3
+# 不影响单页渲染结果的参数，不计入缓存键 (练习内容已体现在每页的 grid_map 中)
+PAGE_CACHE_IGNORED = ('text', 'output_file', 'output_format', 'workers', 'backend', 'raster_dpi')
+
+
+def output_format_of(params):
+    """
+    输出格式: 显式指定的 output_format，否则按输出文件扩展名判断，默认 pdf
+    """
+    fmt = params.get('output_format', 'auto')
+    if fmt and fmt != 'auto': return fmt
+    return RASTER_FORMATS.get(os.path.splitext(params.get('output_file', ''))[1].lower(), 'pdf')
+
+
+def raster_page_path(output_file, page_num):
+    # 多页 PNG 按页编号: 字帖.png -> 字帖_001.png
+    root, ext = os.path.splitext(output_file)
+    return f"{root}_{page_num:03d}{ext}"
+
 # ==========================================
-# 模块 1: 笔顺管理器 (保持不变)
+# 模块 1: 笔顺管理器
 # ==========================================
+def _normalize_orientation(path):
+    """
+    把路径的每个子路径统一为逆时针方向。多个笔画合并成一个复合路径后按 nonzero 规则填充，
+    方向相反的两笔在重叠处会相互抵消而留白；统一方向后重叠处与分别填充时一样是实心的
+    """
+    verts, codes = path.vertices, path.codes
+    if codes is None:
+        codes = np.full(len(verts), Path.LINETO, dtype=Path.code_type)
+        codes[0] = Path.MOVETO
+    starts = list(np.flatnonzero(codes == Path.MOVETO)) + [len(codes)]
+    out_verts, out_codes = [], []
+    changed = False
+    for s, e in zip(starts[:-1], starts[1:]):
+        sub_v, sub_c = verts[s:e], codes[s:e]
+        closed = sub_c[-1] == Path.CLOSEPOLY
+        if closed: sub_v, sub_c = sub_v[:-1], sub_c[:-1]
+        # 控制多边形的有向面积 (鞋带公式)，与曲线轮廓方向一致
+        x, y = sub_v[:, 0], sub_v[:, 1]
+        if np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)) < 0:
+            # 反向: 顶点倒序，线段类型随之倒序 (同一段曲线的各个代码相同)
+            sub_v = sub_v[::-1]
+            sub_c = np.concatenate([[Path.MOVETO], sub_c[1:][::-1]])
+            changed = True
+        out_verts.append(sub_v)
+        out_codes.append(sub_c)
+        if closed:
+            out_verts.append(sub_v[:1])
+            out_codes.append([Path.CLOSEPOLY])
+    if not changed: return path
+    return Path(np.concatenate(out_verts), np.concatenate(out_codes).astype(Path.code_type))
+
+
+class StrokeGeometry:
+    """
+    单个字解析后的笔画几何: Path 列表、包围盒中心，以及归一化变换
+    (把字的包围盒中心移到原点，并缩放到边长为 1 的格子内)
+    fits: 归一化后整字落在格子之内，绘制时无需裁剪
+    """
+    __slots__ = ('paths', 'center', 'norm_matrix', 'fits', '_prefixes')
+
+    def __init__(self, paths, center, norm_matrix, fits=True):
+        self.paths = paths
+        self.center = center
+        self.norm_matrix = norm_matrix
+        self.fits = fits
+        self._prefixes = [None] * len(paths)
+
+    def prefix(self, k):
+        """
+        笔画 0..k 合并成的单个复合路径 (k=None 为整字)，首次使用时生成并随几何一起缓存。
+        笔顺分解一行里每个格子只需一个 PathPatch，不再是 k+1 个
+        """
+        last = len(self.paths) - 1
+        k = last if k is None else min(k, last)
+        if self._prefixes[k] is None:
+            self._prefixes[k] = Path.make_compound_path(*self.paths[:k + 1])
+        return self._prefixes[k]
+
+
 class StrokeManager:
-    def __init__(self, resource_dir):
+    SCALE_FACTOR = 0.88
+    SRC_SCALE_BASE = 1024.0
+
+    def __init__(self, resource_dir, cache_size=256):
         self.data_path = os.path.join(resource_dir, 'strokes.txt')
+        self.store_path = os.path.join(resource_dir, STORE_FILENAME)
         self.char_data = {}
+        self.store = None
         self.loaded = False
         self.has_lib = HAS_SVG_LIB
 
+        # 解析后的笔画几何 LRU 缓存
+        self.cache_size = cache_size
+        self._geom_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # 多个线程共用同一个管理器: 加载与缓存读写在锁内进行，SVG 解析在锁外
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    @property
+    def parse_timer(self):
+        """
+        可选的 SVG 解析计时回调 parse_timer(seconds)，由 GenerationTrace 设置。
+        按线程保存，并发生成时各自的记录互不干扰
+        """
+        return getattr(self._local, 'parse_timer', None)
+
+    @parse_timer.setter
+    def parse_timer(self, timer):
+        self._local.parse_timer = timer
+
+    @property
+    def cache_counter(self):
+        """
+        可选的几何缓存计数回调 cache_counter(hit)，由 GenerationTrace 设置，同样按线程保存。
+        cache_hits / cache_misses 是整个进程 (所有线程) 的累计值，不能用来统计单个任务
+        """
+        return getattr(self._local, 'cache_counter', None)
+
+    @cache_counter.setter
+    def cache_counter(self, counter):
+        self._local.cache_counter = counter
+
     def load_data(self):
         if self.loaded or not self.has_lib: return
-        if not os.path.exists(self.data_path): return
+        with self._lock:
+            # 等锁期间其他线程可能已经加载完成
+            if self.loaded: return
+            # 优先使用编译好的 mmap 笔顺库，按需查找，不再整表解析
+            if self._open_store():
+                self.loaded = True
+                return
+            if not os.path.exists(self.data_path): return
+            try:
+                with open(self.data_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                            self.char_data[entry['character']] = entry['strokes']
+                        except: continue
+                self.loaded = True
+            except: pass
+
+    def _open_store(self):
+        if not os.path.exists(self.store_path): return False
+        # strokes.txt 比编译库新，说明编译库已过期，回退到文本加载
+        if os.path.exists(self.data_path) and \
+                os.path.getmtime(self.data_path) > os.path.getmtime(self.store_path):
+            print("提示: strokes.bin 已过期，请运行 python src/stroke_store.py 重新编译")
+            return False
         try:
-            with open(self.data_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        entry = json.loads(line)
-                        self.char_data[entry['character']] = entry['strokes']
-                    except: continue
-            self.loaded = True
-        except: pass
+            self.store = CompiledStrokeStore(self.store_path)
+        except OSError:
+            return False
+        except ValueError as e:
+            print(f"提示: {e}")
+            return False
+        return True
 
     def get_strokes(self, char):
         if not self.loaded: self.load_data()
+        if self.store is not None:
+            return self.store.get(char) or []
         return self.char_data.get(char, [])
 
-    def draw_char_strokes(self, ax, char, x, y, size, step_index=None, color='black', guide_color=None):
-        if not self.has_lib: return False
+    def stroke_count(self, char):
+        return len(self.get_strokes(char))
+
+    def get_geometry(self, char):
+        """
+        取字的解析几何，命中缓存时不再重复 parse_path
+        """
+        if not self.has_lib: return None
+        counter = self.cache_counter
+        with self._lock:
+            geom = self._geom_cache.get(char)
+            if geom is not None:
+                self._geom_cache.move_to_end(char)
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+        if counter is not None: counter(geom is not None)
+        if geom is not None: return geom
+
+        # 两个线程同时解析同一个字时结果相同，后写入缓存的覆盖先写入的即可
         strokes = self.get_strokes(char)
-        if not strokes: return False
-
-        parsed_paths = []
-        all_verts = []
-        for svg_str in strokes:
-            p = parse_path(svg_str)
-            parsed_paths.append(p)
-            if p.vertices is not None and len(p.vertices) > 0:
-                all_verts.append(p.vertices)
-        
-        if all_verts:
-            stacked = np.vstack(all_verts)
-            min_x, min_y = np.min(stacked, axis=0)
-            max_x, max_y = np.max(stacked, axis=0)
-            actual_center_x = (min_x + max_x) / 2.0
-            actual_center_y = (min_y + max_y) / 2.0
+        if not strokes: return None
+
+        if self.parse_timer is not None: parse_start = time.perf_counter()
+        parsed_paths = [_normalize_orientation(parse_path(svg_str)) for svg_str in strokes]
+        if self.parse_timer is not None: self.parse_timer(time.perf_counter() - parse_start)
+
+        # 包围盒由编译库预先算好；文本数据或编译时无法计算的字才遍历顶点
+        bbox = self.store.bbox(char) if self.store is not None else None
+        if bbox is None:
+            all_verts = [p.vertices for p in parsed_paths if p.vertices is not None and len(p.vertices) > 0]
+            if all_verts:
+                stacked = np.vstack(all_verts)
+                min_x, min_y = np.min(stacked, axis=0)
+                max_x, max_y = np.max(stacked, axis=0)
+                bbox = (min_x, min_y, max_x, max_y)
+        if bbox is not None:
+            min_x, min_y, max_x, max_y = bbox
+            center = ((min_x + max_x) / 2.0, (min_y + max_y) / 2.0)
         else:
-            actual_center_x = 512.0
-            actual_center_y = 512.0
-
-        scale_factor = 0.88 
-        src_scale_base = 1024.0
-        scale = (size * scale_factor) / src_scale_base
-        target_cx = x + size / 2
-        target_cy = y + size / 2
-
-        transform = Affine2D().translate(-actual_center_x, -actual_center_y) \
-                              .scale(scale, scale) \
-                              .translate(target_cx, target_cy)
-        
+            center = (512.0, 512.0)
+
+        unit_scale = self.SCALE_FACTOR / self.SRC_SCALE_BASE
+        norm_matrix = Affine2D().translate(-center[0], -center[1]) \
+                                .scale(unit_scale, unit_scale).get_matrix().copy()
+        # 包围盒居中后按 0.88 缩放，边长不超过格子就不会越界 (MakeMeHanzi 的字都是如此)
+        fits = bbox is None or max(max_x - min_x, max_y - min_y) * unit_scale <= 1.0
+        geom = StrokeGeometry(parsed_paths, center, norm_matrix, fits)
+
+        if self.cache_size > 0:
+            with self._lock:
+                self._geom_cache[char] = geom
+                if len(self._geom_cache) > self.cache_size:
+                    self._geom_cache.popitem(last=False)
+        return geom
+
+    def data_version(self):
+        """
+        笔顺数据的版本 (编译库与文本文件的大小和修改时间)，数据更新后页面缓存随之失效
+        """
+        version = [self.has_lib]
+        for path in (self.store_path, self.data_path):
+            try:
+                st = os.stat(path)
+                version.append((st.st_size, st.st_mtime_ns))
+            except OSError:
+                version.append(None)
+        return version
+
+    def cache_info(self):
+        return {
+            "hits": self.cache_hits, "misses": self.cache_misses,
+            "size": len(self._geom_cache), "maxsize": self.cache_size
+        }
+
+    def clear_cache(self):
+        with self._lock:
+            self._geom_cache.clear()
+            self.cache_hits = 0
+            self.cache_misses = 0
+
+    def draw_char_strokes(self, ax, char, x, y, size, step_index=None, color='black', guide_color=None):
+        if not self.has_lib: return False
+        geom = self.get_geometry(char)
+        if geom is None: return False
+
+        # 归一化变换基础上，放大到格子尺寸并平移到格子中心
+        transform = Affine2D(geom.norm_matrix).scale(size, size) \
+                                              .translate(x + size / 2, y + size / 2)
+
         final_transform = transform + ax.transData
-        clip_rect = patches.Rectangle((x, y), size, size, transform=ax.transData)
-
-        for i, path in enumerate(parsed_paths):
-            should_draw = False
-            fill_color = color
-            if step_index is not None:
-                if i <= step_index:
-                    should_draw = True
-                    fill_color = color 
-                else:
-                    if guide_color is not None:
-                        should_draw = True
-                        fill_color = guide_color
-            else:
-                should_draw = True
-                fill_color = color
-            
-            if should_draw:
-                patch = patches.PathPatch(path, facecolor=fill_color, edgecolor='none', lw=0, transform=final_transform)
-                patch.set_clip_path(clip_rect)
-                ax.add_patch(patch)
+
+        # 已写的笔画 (整字或前 step_index+1 笔) 是一个缓存的复合路径
+        paths, colors = [geom.prefix(step_index)], [color]
+        if step_index is not None and guide_color is not None and step_index + 1 < len(geom.paths):
+            # 未写的笔画用引导色，画在已写笔画之上 (与逐笔绘制时的叠放顺序一致)
+            paths.append(Path.make_compound_path(*geom.paths[step_index + 1:]))
+            colors.append(guide_color)
+
+        if len(paths) == 1:
+            artist = patches.PathPatch(paths[0], facecolor=color, edgecolor='none', lw=0, transform=final_transform)
+            ax.add_patch(artist)
+        else:
+            # 两层合成一个集合对象，越界时只需一次裁剪
+            artist = PathCollection(paths, facecolors=colors, edgecolors='none', linewidths=0,
+                                    transform=final_transform, offset_transform=IdentityTransform())
+            ax.add_collection(artist, autolim=False)
+        # 整字落在格子内时不裁剪 (连默认的坐标区裁剪也关掉)，PDF 里不产生裁剪组
+        if geom.fits:
+            artist.set_clip_on(False)
+        else:
+            artist.set_clip_path(patches.Rectangle((x, y), size, size, transform=ax.transData))
+        return True
+
+    def stamp_char_strokes(self, ax, char, corners, size, step_index=None, color='black'):
+        """
+        把同一个字 (或其前 step_index+1 笔) 盖印到多个格子，corners 为各格左下角 (数据坐标)。
+        整组只生成一个 PathCollection: 路径只按格子大小缩放一次，各格只是平移 (offsets)，
+        PDF 后端把路径写成一个 XObject 供各格引用。整字落在格子内时不裁剪
+        """
+        if not self.has_lib or not corners: return False
+        geom = self.get_geometry(char)
+        if geom is None: return False
+        if not geom.fits:
+            # 越界的字逐格绘制，各格只按自己的格子裁剪一次
+            for x, y in corners:
+                self.draw_char_strokes(ax, char, x, y, size, step_index=step_index, color=color)
+            return True
+
+        # AffineDeltaTransform 只取数据坐标到显示坐标的缩放部分，平移由 offsets 给出
+        path_transform = Affine2D(geom.norm_matrix).scale(size, size) + AffineDeltaTransform(ax.transData)
+        offsets = np.asarray(corners, dtype=float) + size / 2
+        collection = PathCollection([geom.prefix(step_index)], offsets=offsets, transform=path_transform,
+                                    offset_transform=ax.transData, facecolors=color, edgecolors='none', linewidths=0,
+                                    clip_on=False)
+        ax.add_collection(collection, autolim=False)
         return True
 
 # ==========================================
-# 模块 2: 字帖生成器 (支持多页与特殊占位符)
+# 模块 2: 排版引擎 (只负责分页与格子分配，不绘图)
 # ==========================================
-class CopybookGenerator:
+def iter_text_chars(params, config):
+    """
+    将输入文本转换为字符流: 清除换行符，保留 # 作为空行标记
+    text 也可以是逐块产出字符串的可迭代对象 (打开的文本文件、生成器等)，多页模式下边读边排版
+    """
+    text = params['text']
+    if not isinstance(text, str):
+        if params['is_multipage']:
+            return _iter_text_chunks(text)
+        # 单页模式只排一页，且可能需要循环填满，直接读入
+        text = ''.join(text)
+    raw_text = text.replace('\r', '').replace('\n', '')
+
+    # 如果是单页模式且要求填满，需要预先扩充队列
+    if not params['is_multipage'] and params['fill_page'] and raw_text:
+        # 简单处理：如果没 # 号，直接乘；如果有 # 号，逻辑比较复杂
+        # 为了兼容性，这里仅当无特殊格式时重复。
+        # 如果有 # 号，通常意味着用户想精确控制布局，不建议自动循环。
+        if '#' not in raw_text:
+            repeat_count = math.ceil(config['rows'] / len(raw_text))
+            return iter(raw_text * repeat_count)
+    return iter(raw_text)
+
+
+def _iter_text_chunks(chunks):
+    for chunk in chunks:
+        for char in chunk:
+            if char != '\r' and char != '\n': yield char
+
+
+class LayoutEngine:
+    """
+    排版引擎: 顺序消费字符流，每次产出一页的 grid_map (rows×cols，元素为格子描述或 None)
+    字符流只读一遍、不回退，整体耗时与文本长度成线性关系
+    """
+    def __init__(self, config, params, stroke_counter):
+        self.rows, self.cols = config['rows'], config['cols']
+        self.params = params
+        self.is_stroke_mode = (params.get('practice_mode') == "笔顺分解")
+        self.stroke_counter = stroke_counter
+        self.missing_strokes = set()
+        self.chars_laid_out = 0
+
+    def iter_pages(self, chars):
+        it = iter(chars)
+        pending = next(it, None)
+
+        # 只要字符流还有内容，或者至少要生成一页
+        while True:
+            rows, cols = self.rows, self.cols
+            grid_map = [[None] * cols for _ in range(rows)]
+            curr_row = 0
+
+            # 填充当前页
+            while curr_row < rows and pending is not None:
+                # 消耗字符
+                char = pending
+                pending = next(it, None)
+
+                # --- 情况 1: 空行占位符 # ---
+                if char == '#':
+                    curr_row += 1     # 跳过这一行
+                    continue
+
+                self.chars_laid_out += 1
+                if self.is_stroke_mode:
+                    # --- 情况 2: 笔顺分解模式 ---
+                    curr_row = self._place_stroke_char(grid_map, curr_row, char)
+                else:
+                    # --- 情况 3: 普通练习模式 ---
+                    self._place_practice_char(grid_map, curr_row, char)
+                    curr_row += 1
+
+            yield grid_map
+
+            # 退出条件
+            if pending is None:
+                break
+            # 保护：如果是单页模式，强制退出（只生成一页，多余截断）
+            if not self.params['is_multipage']:
+                break
+
+    def _place_stroke_char(self, grid_map, curr_row, char):
+        """
+        放置范字与逐笔分解格，返回下一个可用行
+        """
+        rows, cols = self.rows, self.cols
+        hand_mode = self.params['hand_mode']
+        fill_rest = self.params.get('stroke_rest_mode', 'trace')
+        stroke_count = self.stroke_counter(char)
+        if not stroke_count: self.missing_strokes.add(char)
+        total_strokes = stroke_count or 1
+
+        # 确定方向
+        if hand_mode == 'right':
+            tpl_col, direction = 0, 1
+        else:
+            tpl_col, direction = cols - 1, -1
+
+        # 放置范字
+        grid_map[curr_row][tpl_col] = {'type': 'template', 'char': char}
+
+        # 游标
+        curr_write_r = curr_row
+        curr_write_c = tpl_col + direction
+        steps_done = 0
+
+        # 笔顺填充循环
+        stroke_finished_on_this_page = True
+        while steps_done < total_strokes:
+            # 换行/越界检测
+            if not 0 <= curr_write_c < cols:
+                curr_write_r += 1
+                curr_write_c = 0 if hand_mode == 'right' else (cols - 1)
+
+            # 如果写着写着，超出了当前页的行数
+            if curr_write_r >= rows:
+                # 一个字跨页在字帖里通常不被接受；考虑到“跨页笔顺”极少见
+                # （除非字特别复杂且到了页尾），这里选择截断，剩下的笔画不显示
+                # （下一页会重头开始新字）。
+                stroke_finished_on_this_page = False
+                break
+
+            grid_map[curr_write_r][curr_write_c] = {'type': 'step', 'char': char, 'step': steps_done}
+            curr_write_c += direction
+            steps_done += 1
+
+        # 填充剩余 (同一行的剩余格内容相同，共用一个格子描述)
+        if stroke_finished_on_this_page and curr_write_r < rows:
+            rest_cell = {'type': fill_rest, 'char': char}
+            while 0 <= curr_write_c < cols:
+                grid_map[curr_write_r][curr_write_c] = rest_cell
+                curr_write_c += direction
+
+        return curr_write_r + 1
+
+    def _place_practice_char(self, grid_map, curr_row, char):
+        cols = self.cols
+        if self.params['hand_mode'] == 'left':
+            tpl_col = cols - 1
+            practice_range = range(cols - 2, -1, -1)
+        else:
+            tpl_col = 0
+            practice_range = range(1, cols)
+
+        # 范字
+        row = grid_map[curr_row]
+        row[tpl_col] = {'type': 'template', 'char': char}
+
+        # 练习格
+        p_mode = self.params['practice_mode']
+        trace_cell = {'type': 'trace', 'char': char}
+        empty_cell = {'type': 'empty', 'char': char}
+        for c in practice_range:
+            is_trace = True
+            dist = abs(c - tpl_col) - 1
+            if p_mode == "一半描红" and dist >= (cols-1)//2: is_trace = False
+            if p_mode == "临摹": is_trace = False
+            row[c] = trace_cell if is_trace else empty_cell
+
+
+# ==========================================
+# 模块 3: 页面背景、字体、字形缓存与直接矢量后端
+# ==========================================
+class FontRegistry:
+    """
+    字体登记表: 每个字体文件在进程内只解析、校验一次，之后各页、各次生成共用同一个 FontProperties。
+    文件不存在或 FreeType 打不开时改用系统中找到的中文字体 (都没有时用 matplotlib 默认字体)，
+    原因记在 errors 中。可被多个线程共用
+    """
+    FALLBACK_FAMILIES = ['SimHei', 'Microsoft YaHei', 'SimSun', 'KaiTi', 'PingFang SC', 'Heiti SC',
+                         'Noto Sans CJK SC', 'Source Han Sans SC', 'WenQuanYi Zen Hei', 'WenQuanYi Micro Hei']
+
     def __init__(self):
+        self._fonts = {}   # 参数中的字体路径 -> FontProperties
+        self._fallback = None
+        self.errors = {}   # 字体路径 -> 无法使用的原因
+        self._lock = threading.RLock()
+
+    def get(self, font_path):
+        key = font_path or ''
+        font = self._fonts.get(key)
+        if font is None:
+            with self._lock:
+                font = self._fonts.get(key)
+                if font is None:
+                    font = self._fonts[key] = self._load(font_path)
+        return font
+
+    def _load(self, font_path):
+        if font_path:
+            try:
+                path = os.path.realpath(font_path)
+                get_font(path)   # 能被 FreeType 打开才算有效
+                return FontProperties(fname=path)
+            except Exception as e:
+                self.errors[font_path] = str(e)
+        return self.fallback()
+
+    def fallback(self):
+        with self._lock:
+            if self._fallback is None:
+                for family in self.FALLBACK_FAMILIES:
+                    try:
+                        path = findfont(FontProperties(family=family), fallback_to_default=False)
+                        break
+                    except ValueError: continue
+                else:
+                    path = findfont(FontProperties())
+                self._fallback = FontProperties(fname=path)
+            return self._fallback
+
+
+FONT_REGISTRY = FontRegistry()
+
+
+def embedded_font_sizes(pdf_file):
+    """
+    统计 PDF 中每个嵌入字体的字节数 (字体文件流，Type 3 则为各字形过程)，返回 {字体名: 字节数}。
+    没有安装 pypdf 或读取失败时返回 None
+    """
+    if not HAS_PYPDF: return None
+    try:
+        reader = PdfReader(pdf_file)
+        sizes = {}
+        seen = set()
+        for page in reader.pages:
+            fonts = page.get('/Resources', {}).get('/Font', {})
+            for ref in fonts.values():
+                key = getattr(ref, 'idnum', None)
+                if key in seen: continue
+                seen.add(key)
+                font = ref.get_object()
+                desc_font = font['/DescendantFonts'][0].get_object() if '/DescendantFonts' in font else font
+                n = 0
+                if '/FontDescriptor' in desc_font:
+                    descriptor = desc_font['/FontDescriptor'].get_object()
+                    for name in ('/FontFile', '/FontFile2', '/FontFile3'):
+                        if name in descriptor: n += len(descriptor[name].get_object().get_data())
+                if '/CharProcs' in font:
+                    n += sum(len(proc.get_object().get_data()) for proc in font['/CharProcs'].values())
+                base = str(font.get('/BaseFont', key))
+                sizes[base] = sizes.get(base, 0) + n
+        return sizes
+    except:
+        return None
+
+
+class GlyphOutline:
+    """
+    单个字形的轮廓 (1 em 为单位，基线原点为原点)
+    ink: 墨迹范围 (x0, y0, x1, y1)；advance: 前进宽度
+    anchor: 与 ax.text(ha='center', va='center') 对齐的中心点 —— 水平取墨迹中心，
+            垂直取文字行框中心 (行框高度与下沉量取该字与 "lp" 中的较大者，同 matplotlib 的文字排版)
+    centered: 平移到 anchor 为原点的轮廓，用于盖印到格子中心
+    """
+    __slots__ = ('path', 'ink', 'advance', 'anchor', 'centered')
+
+    def __init__(self, path, ink, advance, anchor):
+        self.path = path
+        self.ink = ink
+        self.advance = advance
+        self.anchor = anchor
+        self.centered = path.transformed(Affine2D().translate(-anchor[0], -anchor[1])) \
+            if path is not None else None
+
+
+class GlyphCache:
+    """
+    字形轮廓缓存: 每个 (字体文件, 字) 只做一次 TextPath 转换，之后按变换盖印到各个格子。
+    轮廓不做 hinting，1 em 的轮廓可用于任意字号，因此不再按字号区分。
+    可被多个线程共用: 缓存读写在锁内，轮廓转换在锁外
+    """
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._line_box = {}   # 字体文件 -> "lp" 的 (下沉量, 高度)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def font_file(font):
+        return font.get_file() or findfont(font)
+
+    def get(self, font, char):
+        font_file = self.font_file(font)
+        key = (font_file, char)
+        with self._lock:
+            glyph = self._cache.get(key)
+            if glyph is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return glyph
+            self.misses += 1
+
+        # 空白字符没有轮廓 (TextPath 对其会报错)，只占前进宽度
+        path = None
+        x0 = y0 = x1 = y1 = 0.0
+        if not char.isspace():
+            path = TextPath((0, 0), char, size=1, prop=font)
+            if len(path.vertices):
+                (x0, y0), (x1, y1) = path.get_extents().get_points()
+            else: path = None
+
+        ft = get_font(font_file)
+        ft.set_size(1000, 72)
+        advance = ft.load_char(ord(char)).linearHoriAdvance / 65536 / 1000
+
+        lp_descent, lp_height = self._lp_box(font, font_file)
+        descent = max(-y0, lp_descent)
+        height = max(y1 - y0, lp_height)
+        glyph = GlyphOutline(path, (x0, y0, x1, y1), advance, ((x0 + x1) / 2, height / 2 - descent))
+
+        if self.max_size > 0:
+            with self._lock:
+                self._cache[key] = glyph
+                if len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+        return glyph
+
+    def _lp_box(self, font, font_file):
+        box = self._line_box.get(font_file)
+        if box is None:
+            (_, y0), (_, y1) = TextPath((0, 0), "lp", size=1, prop=font).get_extents().get_points()
+            box = self._line_box[font_file] = (-y0, y1 - y0)
+        return box
+
+    def stamp(self, ax, font, char, centers, size_pt, color, zorder=3):
+        """
+        把同一个字形盖印到多个格子中心 centers (数据坐标)，大小与位置同
+        ax.text(..., fontsize=size_pt, ha/va='center')。
+        整组只生成一个 PathCollection: 字号按磅 (sizes 为磅的平方) 随 dpi 缩放，
+        PDF 后端把轮廓只写一次，各格子仅引用，zorder 与 ax.text 相同
+        """
+        glyph = self.get(font, char)
+        if glyph.centered is None or not centers: return None
+        collection = PathCollection([glyph.centered], sizes=[size_pt ** 2], offsets=centers,
+                                    transform=IdentityTransform(), offset_transform=ax.transData, facecolors=color,
+                                    edgecolors='none', linewidths=0, zorder=zorder)
+        ax.add_collection(collection, autolim=False)
+        return collection
+
+    def cache_info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache), "maxsize": self.max_size}
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+            self._line_box.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class PageTemplate:
+    """
+    页面背景模板: 同一版式 (纸张、行列、格子大小、网格样式与颜色、字体) 下
+    所有页面共用的几何、网格线段、字体与页眉页脚位置，整份文档只计算一次
+    """
+    def __init__(self, config, params):
+        # 重新计算可用区域
+        top_limit = config['height'] - config['margin_y'] - config['title_space']
+        bottom_limit = config['margin_y'] + 0.3
+        available_h = top_limit - bottom_limit
+        available_w = config['width'] - (2 * config['margin_x'])
+
+        # 格子大小计算
+        size_type = params.get('grid_size_type', 'auto')
+        if size_type == 'fixed':
+            try: cell_size = float(params.get('grid_size_val')) / 2.54
+            except: cell_size = 1.5 / 2.54
+        else:
+            cell_w = available_w / config['cols']
+            cell_h = available_h / config['rows']
+            cell_size = min(cell_w, cell_h)
+
+        real_grid_width = cell_size * config['cols']
+        real_grid_height = cell_size * config['rows']
+        actual_margin_x = (config['width'] - real_grid_width) / 2
+
+        # 对齐
+        align_mode = params.get('align_mode', 'center')
+        if align_mode == 'top': start_y = top_limit - real_grid_height
+        else: start_y = bottom_limit + (available_h - real_grid_height) / 2
+        if start_y < bottom_limit: start_y = top_limit - real_grid_height
+
+        self.cell_size = cell_size
+        self.margin_x = actual_margin_x
+        self.start_y = start_y
+
+        self.font = FONT_REGISTRY.get(params.get('font_path'))
+
+        # 格子几何整页一次算成数组: 各列左边 x、各行底边 y (第 0 行在最上) 与格子中心，
+        # 逐格绘制时只按行列下标取值
+        rows, cols = config['rows'], config['cols']
+        self.cell_x = actual_margin_x + np.arange(cols) * cell_size
+        self.cell_y = start_y + (rows - 1 - np.arange(rows)) * cell_size
+        self.center_x = self.cell_x + cell_size / 2
+        self.center_y = self.cell_y + cell_size / 2
+        self.glyph_y = self.center_y - cell_size * 0.05   # 范字与描红字形略低于格子中心
+
+        # 网格外框 (rows×cols, 4, 2) 与辅助线段 (n, 2, 2)，按行优先逐格排列
+        x0, y0 = [a.ravel() for a in np.meshgrid(self.cell_x, self.cell_y)]
+        cx, cy = [a.ravel() for a in np.meshgrid(self.center_x, self.center_y)]
+        x1, y1 = x0 + cell_size, y0 + cell_size
+        self.frame_verts = np.stack([np.stack(p, axis=-1) for p in ((x0, y0), (x1, y0), (x1, y1), (x0, y1))], axis=1)
+        segs = []
+        if params['grid_style'] in ["米字格", "田字格"]:
+            segs += [((x0, cy), (x1, cy)), ((cx, y0), (cx, y1))]
+        if params['grid_style'] == "米字格":
+            segs += [((x0, y0), (x1, y1)), ((x0, y1), (x1, y0))]
+        if segs:
+            # (格子, 线段, 端点, xy) -> 每格的线段相邻
+            self.guide_segs = np.stack([np.stack([np.stack(end, axis=-1) for end in seg], axis=1) for seg in segs],
+                                       axis=1).reshape(-1, 2, 2)
+        else:
+            self.guide_segs = np.empty((0, 2, 2))
+        self.grid_color = params['grid_color']
+
+        # 标题与页脚
+        self.title_pos = (config['width']/2, config['height'] - config['margin_y'] - (config['title_space'] / 2) + 0.1)
+        self.footer_pos = (config['width']/2, 0.3)
+        if size_type == 'fixed': size_str = f"{params.get('grid_size_val')}cm"
+        else: size_str = f"约{cell_size * 2.54:.1f}cm"
+        self.grid_info = f"{config['rows']}行×{config['cols']}列 ({size_str}/格)"
+
+    @staticmethod
+    def key_of(config, params):
+        return (config['width'], config['height'], config['rows'], config['cols'], config['has_title'],
+                params.get('grid_size_type', 'auto'), params.get('grid_size_val'),
+                params.get('align_mode', 'center'), params['grid_style'], params['grid_color'],
+                params.get('font_path'))
+
+    def pdf_frames(self):
+        """
+        直接矢量后端用的网格外框内容 (单位: 英寸)
+        """
+        content = PdfContent()
+        content.stroke_color(self.grid_color)
+        content.line_width(0.8 / 72)
+        for (x, y), _, (x2, y2), _ in self.frame_verts.tolist():
+            content.rect(x, y, x2 - x, y2 - y)
+        content.stroke()
+        return content
+
+    def pdf_guides(self, alpha_gs):
+        content = PdfContent()
+        content.ext_gstate('GA', alpha_gs)
+        content.stroke_color(self.grid_color)
+        content.line_width(0.5 / 72)
+        # 与 matplotlib 的 ':' 线型一致: 点线图案 [1, 1.65] 按线宽缩放
+        content.dash([0.5 / 72, 0.825 / 72])
+        for (x0, y0), (x1, y1) in self.guide_segs.tolist():
+            content.line(x0, y0, x1, y1)
+        content.stroke()
+        return content
+
+    def draw(self, ax):
+        """
+        返回 (外框, 辅助线) 两个集合对象，无辅助线时后者为 None
+        """
+        # 网格背景: 外框与辅助线各合并为一个集合对象，艺术家数量与行列数无关
+        frames = ax.add_collection(PolyCollection(self.frame_verts, closed=True, linewidths=0.8, joinstyle='miter',
+                                                  edgecolors=self.grid_color, facecolors='none'))
+        guides = None
+        if len(self.guide_segs):
+            # zorder 与原先 ax.plot 的 Line2D 一致，保持辅助线压在笔画之上
+            guides = ax.add_collection(LineCollection(self.guide_segs, colors=self.grid_color, linestyles=':',
+                                                      linewidths=0.5, alpha=0.6, zorder=2))
+        return frames, guides
+
+
+class RasterPageWriter:
+    """
+    栅格输出 (PNG / 多页 TIFF): 整个任务只创建一个 Figure 与 Agg 画布。
+    白底与网格外框只绘制一次并用 copy_from_bbox 保存，每页先 restore_region 恢复，
+    再按 zorder 只绘制本页的格子内容、辅助线与文字，画完立即写盘，内存占用与页数无关。
+    与直接矢量后端一样按实际纸张尺寸输出 (A4 300dpi 为 2481×3508)。
+    """
+    def __init__(self, generator, config, params, template, dpi):
+        self.generator = generator
+        self.config = config
+        self.params = params
+        self.template = template
+        self.dpi = dpi
+
+        self.fig = Figure(figsize=(config['width'], config['height']), dpi=dpi, facecolor='white')
+        self.canvas = FigureCanvasAgg(self.fig)
+        ax = self.ax = self.fig.add_axes([0, 0, 1, 1])
+        ax.axis('off')
+        ax.set_xlim(0, config['width'])
+        ax.set_ylim(0, config['height'])
+
+        # 辅助线压在笔画之上，不能放进背景，每页随本页内容一起绘制
+        _, self.guides = template.draw(ax)
+        if self.guides is not None: self.guides.set_visible(False)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        if self.guides is not None: self.guides.set_visible(True)
+        self.size = self.canvas.get_width_height()
+
+    def render(self, grid_map, page_num):
+        """
+        绘制一页，返回 (RGBA 缓冲区, 本页绘图元素数)；缓冲区在下一页绘制时被覆盖
+        """
+        ax = self.ax
+        self.canvas.restore_region(self.background)
+        before = set(ax.get_children())
+        self.generator.draw_page_cells(ax, self.config, self.params, self.template, grid_map, glyph_paths=True)
+        self.generator.draw_page_text(ax, self.config, self.params, self.template, page_num)
+        artists = [a for a in ax.get_children() if a not in before]
+
+        layer = artists + [self.guides] if self.guides is not None else artists
+        # 与 Axes.draw 相同: 按 zorder 稳定排序
+        for artist in sorted(layer, key=lambda a: a.get_zorder()):
+            ax.draw_artist(artist)
+        for artist in artists:
+            artist.remove()
+        return self.canvas.buffer_rgba(), len(artists)
+
+    def image(self, buf):
+        return Image.frombuffer('RGBA', self.size, buf, 'raw', 'RGBA', 0, 1).convert('RGB')
+
+
+class VectorPageWriter:
+    """
+    直接矢量 PDF 后端: 网格背景、每个不同的笔画组合与每个不同的字形各写成一个
+    Form XObject，页面内容流里只有引用和颜色。XObject 本身不带颜色，
+    由引用处设置填充色，因此黑色范字与灰色描红共用同一份轮廓。
+    内容相同的行 (全描红、临摹、循环填满时很常见) 第二次出现时整行写成一个 XObject，
+    之后各处只平移引用。
+    """
+    TRACE_COLOR = '#D3D3D3'
+    ROW_CACHE_SIZE = 1024
+
+    def __init__(self, doc, stroke_mgr, glyph_cache, config, params, template):
+        self.doc = doc
+        self.stroke_mgr = stroke_mgr
+        self.glyph_cache = glyph_cache
+        self.config = config
+        self.params = params
+        self.template = template
+        self.is_stroke_mode = (params.get('practice_mode') == "笔顺分解")
+
+        page_box = [0, 0, config['width'], config['height']]
+        self.frames_id = doc.add_form(template.pdf_frames(), page_box)
+        self.guides_id = doc.add_form(template.pdf_guides(doc.add_ext_gstate(0.6)), page_box) \
+            if len(template.guide_segs) else None
+
+        self._stroke_forms = {}   # (char, step) -> 对象号
+        self._glyph_forms = {}    # (字体文件, char) -> (对象号, 字形轮廓)
+        self._form_boxes = {}     # 对象号 -> BBox
+        # 行内容 -> 整行 XObject 的对象号 (只出现过一次的行为 None)，LRU，流式生成时内存也有上限
+        self._row_forms = OrderedDict()
+        self._mark_font = FontProperties()
+
+    def write_page(self, grid_map, page_num, draw_title):
+        config, params, template = self.config, self.params, self.template
+        cell_size = template.cell_size
+        content = PdfContent()
+        # 页面坐标统一用英寸，与 matplotlib 的数据坐标一致
+        content.concat(72, 0, 0, 72, 0, 0)
+        content.draw_xobject('BG', self.frames_id)
+
+        center_x, center_y = template.center_x.tolist(), template.center_y.tolist()
+        current_color = None
+        for r, row in enumerate(grid_map):
+            plan = tuple((c, d['type'], d.get('char', ''), d.get('step')) for c, d in enumerate(row) if d)
+            if not plan: continue
+            row_id = self._row_form(plan, row, center_x, cell_size)
+            if row_id is not None:
+                content.draw_xobject(f'R{row_id}', row_id, (1, 0, 0, 1, 0, center_y[r]))
+                continue
+            for form_id, matrix, color in self._row_cells(row, center_x, center_y[r], cell_size):
+                if color != current_color:
+                    content.fill_color(color)
+                    current_color = color
+                content.draw_xobject(f'X{form_id}', form_id, matrix)
+
+        # 辅助线压在字之上，与 matplotlib 后端的叠放顺序一致
+        if self.guides_id is not None:
+            content.draw_xobject('GD', self.guides_id)
+
+        if draw_title:
+            title = params['custom_title'] if params['custom_title'] else "标题"
+            self._text(content, title, template.font, config['title_size'], template.title_pos, 'black')
+        page_info = f" - 第 {page_num} 页" if params['is_multipage'] else ""
+        note = f"字帖生成器{page_info} - {template.grid_info}"
+        self._text(content, note, template.font, 10, template.footer_pos, 'gray')
+
+        self.doc.add_page(content, config['width'] * 72, config['height'] * 72)
+
+    def _row_cells(self, row, center_x, cy, size):
+        placements = []
+        for c, cell_data in enumerate(row):
+            if not cell_data: continue
+            placed = self._place_cell(cell_data, center_x[c], cy, size)
+            if placed is not None: placements.append(placed)
+        return placements
+
+    def _row_form(self, plan, row, center_x, size):
+        """
+        内容相同的行第二次出现时写成整行 XObject (以行中心为 y 原点) 并返回对象号；
+        首次出现返回 None，由调用方直接逐格绘制，只用一次的行不多占对象
+        """
+        if plan not in self._row_forms:
+            self._row_forms[plan] = None
+            if len(self._row_forms) > self.ROW_CACHE_SIZE: self._row_forms.popitem(last=False)
+            return None
+        self._row_forms.move_to_end(plan)
+        row_id = self._row_forms[plan]
+        if row_id is not None: return row_id
+
+        content = PdfContent()
+        box = [np.inf, np.inf, -np.inf, -np.inf]
+        current_color = None
+        for form_id, matrix, color in self._row_cells(row, center_x, 0.0, size):
+            if color != current_color:
+                content.fill_color(color)
+                current_color = color
+            content.draw_xobject(f'X{form_id}', form_id, matrix)
+            # 行的 BBox 取各格 XObject 放置后 BBox 的并集 (放置矩阵只有缩放与平移)
+            a, _, _, d, e, f = matrix
+            x0, y0, x1, y1 = self._form_boxes[form_id]
+            box = [min(box[0], a * x0 + e), min(box[1], d * y0 + f), max(box[2], a * x1 + e), max(box[3], d * y1 + f)]
+        if box[0] == np.inf: box = [0, 0, 0, 0]
+        row_id = self._row_forms[plan] = self.doc.add_form(content, box)
+        return row_id
+
+    def _place_cell(self, cell_data, cx, cy, size):
+        """
+        返回 (XObject, 放置矩阵, 填充色)，与 _render_page 的格子绘制逻辑一一对应
+        """
+        ctype = cell_data['type']
+        char = cell_data.get('char', '')
+        if ctype == 'template' or ctype == 'trace':
+            color = 'black' if ctype == 'template' else self.TRACE_COLOR
+            if self.is_stroke_mode:
+                form_id = self._stroke_form(char, None)
+                if form_id is not None:
+                    return form_id, (size, 0, 0, size, cx, cy), color
+            # 与 ax.text 一致: 字号为格子的 0.8，中心下移 0.05 格
+            return self._glyph_in_box(self.template.font, char, size * 0.8, cx, cy - size * 0.05) + (color,)
+        if ctype == 'step':
+            form_id = self._stroke_form(char, cell_data['step'])
+            if form_id is not None:
+                return form_id, (size, 0, 0, size, cx, cy), self.TRACE_COLOR
+            return self._glyph_in_box(self._mark_font, '?', 10 / 72, cx, cy) + ('red',)
+        return None
+
+    def _stroke_form(self, char, step):
+        key = (char, step)
+        if key in self._stroke_forms: return self._stroke_forms[key]
+        geom = self.stroke_mgr.get_geometry(char)
+        form_id = None
+        if geom is not None:
+            content = PdfContent()
+            # 笔画方向已统一，合并路径一次填充即可
+            content.path(geom.prefix(step), geom.norm_matrix)
+            content.fill()
+            # 单位格坐标，BBox 即格子范围，相当于按格裁剪
+            form_id = self.doc.add_form(content, [-0.5, -0.5, 0.5, 0.5])
+            self._form_boxes[form_id] = (-0.5, -0.5, 0.5, 0.5)
+        self._stroke_forms[key] = form_id
+        return form_id
+
+    def _glyph_form(self, font, char):
+        key = (GlyphCache.font_file(font), char)
+        entry = self._glyph_forms.get(key)
+        if entry is not None: return entry
+        # 轮廓来自共享的字形缓存，以 1 em 为单位、基线原点为原点
+        glyph = self.glyph_cache.get(font, char)
+        content = PdfContent()
+        if glyph.path is not None:
+            content.path(glyph.path)
+            content.fill()
+        x0, y0, x1, y1 = glyph.ink
+        form_id = self.doc.add_form(content, [x0 - 0.01, y0 - 0.01, x1 + 0.01, y1 + 0.01])
+        self._form_boxes[form_id] = (x0 - 0.01, y0 - 0.01, x1 + 0.01, y1 + 0.01)
+        entry = self._glyph_forms[key] = (form_id, glyph)
+        return entry
+
+    def _glyph_in_box(self, font, char, em, cx, cy):
+        form_id, glyph = self._glyph_form(font, char)
+        # 与 matplotlib 后端的 GlyphCache.stamp 使用同一个锚点 (stamp 盖印的 glyph.centered 以 anchor 为原点)
+        anchor_x, anchor_y = glyph.anchor
+        return form_id, (em, 0, 0, em, cx - anchor_x * em, cy - anchor_y * em)
+
+    def _text(self, content, text, font, size_pt, pos, color):
+        """
+        单行文字按字形 XObject 逐字摆放，水平、垂直均居中于 pos
+        """
+        em = size_pt / 72
+        glyphs = []
+        pen = 0.0
+        ink = [np.inf, np.inf, -np.inf, -np.inf]
+        for char in text:
+            form_id, glyph = self._glyph_form(font, char)
+            x0, y0, x1, y1 = glyph.ink
+            glyphs.append((form_id, pen))
+            if x1 > x0 or y1 > y0:
+                ink = [min(ink[0], pen + x0), min(ink[1], y0), max(ink[2], pen + x1), max(ink[3], y1)]
+            pen += glyph.advance
+        if not glyphs or ink[0] == np.inf: return
+        ox = pos[0] - (ink[0] + ink[2]) / 2 * em
+        oy = pos[1] - (ink[1] + ink[3]) / 2 * em
+        content.save()
+        content.fill_color(color)
+        for form_id, pen in glyphs:
+            content.draw_xobject(f'X{form_id}', form_id, (em, 0, 0, em, ox + pen * em, oy))
+        content.restore()
+
+
+class GenerationCancelled(Exception):
+    """生成过程被取消"""
+
+
+class _JobProgress:
+    """
+    单次生成任务的进度回调、取消检查与可选的性能记录 (trace)
+    """
+    def __init__(self, callback, cancel_event, trace=None):
+        self.callback = callback
+        self.cancel_event = cancel_event
+        self.trace = trace
+        self.layout_engine = None
+
+    def check(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise GenerationCancelled()
+
+    def report(self, stage, done, total):
+        if self.callback is not None: self.callback(stage, done, total)
+
+    def collect_layout(self, pages):
+        collected = []
+        for grid_map in pages:
+            self.check()
+            collected.append(grid_map)
+            self.report('layout', len(collected), None)
+        self.report('layout', len(collected), len(collected))
+        return collected
+
+
+class GenerationTrace:
+    """
+    可选的性能记录: 逐页、逐阶段的耗时与计数。不传给 generate_pdf 时生成流程不做任何记录
+
+    阶段 (秒): load 加载笔顺库 / layout 排版 / parse 解析笔画 SVG / draw 创建绘图元素 (不含 parse) /
+               save 写入 PDF / finalize 关闭输出文件 (写入字体等) /
+               render、merge 并行渲染与合并 (使用页面缓存时 merge 为合并各页并叠加页脚)
+    计数: 排版字数、笔画几何缓存命中/未命中、页面缓存命中/未命中、绘图元素数、写入字节数 (含关闭时写出的)、
+          嵌入字体字节数 (PDF，需 pypdf)
+
+    callback(event): 每页结束收到 {"event": "page", ...}，全部结束收到 {"event": "summary", ...}
+    json_path: 结束时写入 {"summary": ..., "pages": [...]}
+    profile_page: 用 cProfile 记录第几页 (从 1 开始) 的绘制与写入，
+        统计存入 profile_path (.prof，可用 snakeviz 等查看)，前 30 行文本附在 summary 中
+    """
+    def __init__(self, callback=None, json_path=None, profile_page=None, profile_path=None):
+        self.callback = callback
+        self.json_path = json_path
+        self.profile_page = profile_page
+        self.profile_path = profile_path
+        self.stages = {}
+        self.pages = []
+        self.summary = None
+        self._layout_times = []
+        self._parse_time = 0.0
+        # 本任务 (本线程) 的几何缓存命中与未命中次数
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._bytes = 0
+        self._finalize_bytes = None
+        self._profiler = None
+        self.profile_text = None
+
+    def add_stage(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_parse(self, seconds):
+        self._parse_time += seconds
+        self.add_stage('parse', seconds)
+
+    def add_finalize(self, seconds, bytes_written=None):
+        """
+        写出器关闭的耗时 (PdfPages.close 写入字体与交叉引用表等) 与关闭时写出的字节数
+        """
+        self.add_stage('finalize', seconds)
+        if bytes_written is not None: self._finalize_bytes = bytes_written - self._bytes
+
+    def add_cache_lookup(self, hit):
+        if hit: self._cache_hits += 1
+        else: self._cache_misses += 1
+
+    def timed_layout(self, pages):
+        """
+        包装排版生成器，记录每页的排版耗时
+        """
+        it = iter(pages)
+        while True:
+            start = time.perf_counter()
+            try: grid_map = next(it)
+            except StopIteration: return
+            elapsed = time.perf_counter() - start
+            self._layout_times.append(elapsed)
+            self.add_stage('layout', elapsed)
+            yield grid_map
+
+    def begin(self, stroke_mgr):
+        self._start = time.perf_counter()
+        self._stroke_mgr = stroke_mgr
+        stroke_mgr.parse_timer = self.add_parse
+        stroke_mgr.cache_counter = self.add_cache_lookup
+
+    def start_page(self, page_num):
+        self._page = {"page": page_num, "hits": self._cache_hits, "misses": self._cache_misses,
+                      "parse": self._parse_time}
+        if page_num == self.profile_page:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._page_start = self._mark = time.perf_counter()
+
+    def mark_page_cache(self, hit):
+        self._page['page_cache'] = 'hit' if hit else 'miss'
+
+    def mark_drawn(self, artists=None):
+        now = time.perf_counter()
+        self._page['draw_total'] = now - self._page_start
+        self._page['artists'] = artists
+        self._mark = now
+
+    def end_page(self, bytes_written=None):
+        now = time.perf_counter()
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._save_profile()
+        page = self._page
+        parse = self._parse_time - page['parse']
+        draw = page.get('draw_total', now - self._page_start) - parse
+        save = now - self._mark if 'draw_total' in page else 0.0
+        index = len(self.pages)
+        record = {
+            "page": page['page'],
+            "layout": round(self._layout_times[index], 6) if index < len(self._layout_times) else None,
+            "parse": round(parse, 6), "draw": round(draw, 6), "save": round(save, 6),
+            "artists": page.get('artists'),
+            "cache_hits": self._cache_hits - page['hits'], "cache_misses": self._cache_misses - page['misses'],
+            "bytes": bytes_written - self._bytes if bytes_written is not None else None
+        }
+        if 'page_cache' in page: record['page_cache'] = page['page_cache']
+        if bytes_written is not None: self._bytes = bytes_written
+        self.add_stage('draw', draw)
+        self.add_stage('save', save)
+        self.pages.append(record)
+        if self.callback is not None: self.callback(dict(record, event="page"))
+
+    def _save_profile(self):
+        if self.profile_path: self._profiler.dump_stats(self.profile_path)
+        out = io.StringIO()
+        pstats.Stats(self._profiler, stream=out).sort_stats('cumulative').print_stats(30)
+        self.profile_text = out.getvalue()
+        self._profiler = None
+
+    def finish(self, output_file, chars_laid_out):
+        self._stroke_mgr.parse_timer = None
+        self._stroke_mgr.cache_counter = None
+        artists = [p['artists'] for p in self.pages if p['artists'] is not None]
+        self.summary = {
+            "total_seconds": round(time.perf_counter() - self._start, 6),
+            "stages": {k: round(v, 6) for k, v in self.stages.items()},
+            "pages": max(len(self.pages), len(self._layout_times)),
+            "chars_laid_out": chars_laid_out,
+            "cache_hits": self._cache_hits,
+            "cache_misses": self._cache_misses,
+            "artists": sum(artists) if artists else None,
+            "finalize_bytes": self._finalize_bytes,
+            "bytes_written": os.path.getsize(output_file) if os.path.exists(output_file) else (self._bytes or None),
+        }
+        cached = [p['page_cache'] for p in self.pages if 'page_cache' in p]
+        if cached:
+            hits = cached.count('hit')
+            self.summary['page_cache'] = {"hits": hits, "misses": len(cached) - hits,
+                                          "hit_rate": round(hits / len(cached), 4)}
+        if output_file.lower().endswith('.pdf') and os.path.exists(output_file):
+            fonts = embedded_font_sizes(output_file)
+            if fonts is not None:
+                self.summary['fonts'] = fonts
+                self.summary['font_bytes'] = sum(fonts.values())
+        if self.profile_text:
+            self.summary['profile_page'] = self.profile_page
+            self.summary['profile_path'] = self.profile_path
+            self.summary['profile_top'] = self.profile_text.splitlines()
+        if self.json_path:
+            with open(self.json_path, 'w', encoding='utf-8') as f:
+                json.dump({"summary": self.summary, "pages": self.pages}, f, ensure_ascii=False, indent=2)
+        if self.callback is not None: self.callback(dict(self.summary, event="summary"))
+
+    def abort(self):
+        if self._profiler is not None: self._profiler.disable()
+        self._profiler = None
+        if getattr(self, '_stroke_mgr', None) is not None:
+            self._stroke_mgr.parse_timer = None
+            self._stroke_mgr.cache_counter = None
+
+
+_pdf_rc_cond = threading.Condition()
+_pdf_rc_users = 0
+_pdf_rc_value = None
+_pdf_rc_saved = None
+
+@contextmanager
+def _pdf_font_type(fonttype=3):
+    """
+    写 PDF 期间 (直到 PdfPages 关闭) 把 rcParams['pdf.fonttype'] 设为 fonttype，结束后恢复原值。
+    rcParams 是进程全局的，rc_context 在多个线程同时生成时会互相恢复对方的设置，
+    因此这里计数: 第一个进入的线程设置，最后一个退出的线程恢复；
+    要求另一种字体类型的线程等正在写的全部结束后再进入
+    """
+    global _pdf_rc_users, _pdf_rc_value, _pdf_rc_saved
+    if fonttype not in PDF_FONTTYPES:
+        raise ValueError(f"pdf_fonttype 只能是 {PDF_FONTTYPES}，收到 {fonttype!r}")
+    with _pdf_rc_cond:
+        while _pdf_rc_users and _pdf_rc_value != fonttype:
+            _pdf_rc_cond.wait()
+        if _pdf_rc_users == 0:
+            _pdf_rc_saved = matplotlib.rcParams['pdf.fonttype']
+            _pdf_rc_value = fonttype
+            matplotlib.rcParams['pdf.fonttype'] = fonttype
+        _pdf_rc_users += 1
+    try:
+        yield
+    finally:
+        with _pdf_rc_cond:
+            _pdf_rc_users -= 1
+            if _pdf_rc_users == 0:
+                matplotlib.rcParams['pdf.fonttype'] = _pdf_rc_saved
+                _pdf_rc_cond.notify_all()
+
+
+def _dedupe_pdf_objects(writer):
+    """
+    合并多份 PDF 后去掉内容相同的重复对象 (各份各自嵌入的同一字形过程等)。
+    新版 pypdf 的参数名为 remove_duplicates / remove_unreferenced，旧版为 remove_identicals / remove_orphans，
+    没有 compress_identical_objects 的版本不去重
+    """
+    dedupe = getattr(writer, 'compress_identical_objects', None)
+    if dedupe is None: return
+    try: dedupe(remove_duplicates=True, remove_unreferenced=True)
+    except TypeError: dedupe(remove_identicals=True, remove_orphans=True)
+
+
+def _parallel_workers(requested, page_count):
+    """
+    实际使用的进程数: 不超过 CPU 核数 (单核上并行只有进程开销)，且每个进程至少分到 PARALLEL_MIN_PAGES 页；
+    结果为 1 时改为串行生成
+    """
+    return max(1, min(requested, os.cpu_count() or 1, page_count // PARALLEL_MIN_PAGES))
+
+
+def _pdf_bytes_written(pdf):
+    # PdfPages 没有公开当前写入位置，取内部文件句柄；取不到时不记录字节数
+    try: return pdf._file.fh.tell()
+    except: return None
+
+
+# ==========================================
+# 模块 4: 字帖生成器 (支持多页与特殊占位符)
+# ==========================================
+class CopybookGenerator:
+    def __init__(self, stroke_cache_size=256, page_cache=None):
         self.DPI = 300
         current_dir = os.path.dirname(os.path.abspath(__file__))
-        resource_dir = os.path.join(os.path.dirname(current_dir), 'resources')
-        self.stroke_mgr = StrokeManager(resource_dir)
+        self.resource_dir = os.path.join(os.path.dirname(current_dir), 'resources')
+        self.stroke_mgr = StrokeManager(self.resource_dir, cache_size=stroke_cache_size)
+        self.glyph_cache = GlyphCache()
+        self._page_templates = {}
+        self._template_lock = threading.Lock()
+        # 可选的 PageCache: 设置后逐页生成 PDF 时只重新渲染内容变化的页
+        self.page_cache = page_cache
+
+    def default_font_path(self):
+        font = os.path.join(self.resource_dir, 'simkai.ttf')
+        return font if os.path.exists(font) else ""
+
+    def get_page_template(self, config, params):
+        key = PageTemplate.key_of(config, params)
+        with self._template_lock:
+            template = self._page_templates.get(key)
+            if template is None:
+                # 版式种类很少，超出上限直接清空即可
+                if len(self._page_templates) >= 16: self._page_templates.clear()
+                template = PageTemplate(config, params)
+                self._page_templates[key] = template
+        return template
 
     def get_layout_config(self, params):
         paper_type = params.get('paper_size', 'A4')
@@ -142,279 +1392,433 @@ class CopybookGenerator:
             "has_title": has_title
         }
 
-    def generate_pdf(self, params):
+    def layout_pages(self, params, config=None):
+        """
+        逐页产出排版结果 (grid_map)，是生成器，不做任何绘图
+        """
+        if config is None: config = self.get_layout_config(params)
+        engine = LayoutEngine(config, params, self.stroke_mgr.stroke_count)
+        return engine.iter_pages(iter_text_chars(params, config))
+
+    def dry_run(self, params, include_cells=True):
+        """
+        只排版不绘图: 返回页数、各页格子分配以及缺少笔顺数据的字 (仅笔顺分解模式)
+        100k 字级别的文本也能即时估算页数；include_cells=False 时不保留格子分配
+        """
         config = self.get_layout_config(params)
+        engine = LayoutEngine(config, params, self.stroke_mgr.stroke_count)
+        page_count = 0
+        pages = []
+        for grid_map in engine.iter_pages(iter_text_chars(params, config)):
+            page_count += 1
+            if include_cells: pages.append(grid_map)
+        return {
+            "page_count": page_count,
+            "pages": pages if include_cells else None,
+            "missing_strokes": sorted(engine.missing_strokes),
+            "chars_laid_out": engine.chars_laid_out
+        }
+
+    def generate_pdf(self, params, progress=None, cancel_event=None, trace=None):
+        """
+        生成 PDF 字帖
+        progress(stage, done, total): 进度回调，stage 为 'layout' / 'render' / 'write'，
+            total 为总页数 (排版阶段尚未结束时为 None)
+        cancel_event: 带 is_set() 的对象 (如 threading.Event)，置位后在页与页之间停止并抛出
+            GenerationCancelled；输出先写入临时文件，成功后才替换目标文件，不会留下半成品
+        trace: 可选的 GenerationTrace，记录逐页、逐阶段的耗时与计数
+        输出格式由 output_format 或 output_file 的扩展名决定 (见 output_format_of):
+            pdf / tiff 输出单个文件；png 每页一个文件，多页模式下按页编号 (字帖_001.png …)
+        同一个生成器可在多个线程中同时调用 (输出文件各不相同即可)，笔顺、字体、字形与版式缓存在线程间共享
+        streaming=True 时 (多页模式) text 可为文件或迭代器，逐页排版、渲染并写出，不保留已完成的页，
+            峰值内存只取决于一页的图形与有上限的缓存，与文本长度无关
+        """
+        job = _JobProgress(progress, cancel_event, trace)
+        final_path = params['output_file']
+        if output_format_of(params) == 'png':
+            # 逐页独立文件，每页各自先写临时文件再替换
+            try:
+                self._generate(params, job)
+            except BaseException:
+                if trace is not None: trace.abort()
+                raise
+            if trace is not None: trace.finish(final_path, job.layout_engine.chars_laid_out)
+            return
+
+        tmp_path = final_path + '.part'
+        try:
+            self._generate(dict(params, output_file=tmp_path, output_format=output_format_of(params)), job)
+            os.replace(tmp_path, final_path)
+        except BaseException:
+            if trace is not None: trace.abort()
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            raise
+        if trace is not None: trace.finish(final_path, job.layout_engine.chars_laid_out)
+
+    def _generate(self, params, job):
+        config = self.get_layout_config(params)
+        trace = job.trace
+        if trace is not None: trace.begin(self.stroke_mgr)
+
         is_stroke_mode = (params.get('practice_mode') == "笔顺分解")
-        if is_stroke_mode: self.stroke_mgr.load_data()
-
-        # --- 文本预处理 ---
-        # 将输入文本转换为字符队列
-        # 清除换行符，保留 # 作为空行标记
-        raw_text = params['text'].replace('\r', '').replace('\n', '')
-        
-        # 核心：构建处理队列
-        # 队列中的元素要么是普通字符，要么是 '#'
-        text_queue = list(raw_text)
-        
-        # 如果是单页模式且要求填满，且没字了，需要预先扩充队列
-        if not params['is_multipage'] and params['fill_page'] and raw_text:
-            # 简单处理：如果没 # 号，直接乘；如果有 # 号，逻辑比较复杂
-            # 为了兼容性，这里仅当无特殊格式时重复。
-            # 如果有 # 号，通常意味着用户想精确控制布局，不建议自动循环。
-            if '#' not in raw_text:
-                 repeat_count = math.ceil(config['rows'] / len(raw_text))
-                 text_queue = list(raw_text * repeat_count)
-
-        # 打开 PDF 多页上下文
-        with PdfPages(params['output_file']) as pdf:
-            page_num = 1
-            
-            # 只要队列还有内容，或者至少要生成一页
-            while True:
-                # ================= 计算本页布局 =================
-                rows, cols = config['rows'], config['cols']
-                grid_map = [[None for _ in range(cols)] for _ in range(rows)]
-                
-                curr_row = 0
-                
-                # 填充当前页
-                while curr_row < rows and text_queue:
-                    char = text_queue[0] # 预览下一个字符
-                    
-                    # --- 情况 1: 空行占位符 # ---
-                    if char == '#':
-                        text_queue.pop(0) # 消耗掉
-                        curr_row += 1     # 跳过这一行
-                        continue
-                    
-                    # --- 情况 2: 笔顺分解模式 ---
-                    if is_stroke_mode:
-                        hand_mode = params['hand_mode']
-                        fill_rest = params.get('stroke_rest_mode', 'trace')
-                        strokes = self.stroke_mgr.get_strokes(char)
-                        total_strokes = len(strokes) if strokes else 1
-                        
-                        # 预计算需要的行数 (粗略估计，只为多页逻辑服务)
-                        # 精确计算比较复杂，这里采用“试探性填充”逻辑
-                        # 如果这个字需要跨行，且当前页剩下行数不足以写完它的大部分？
-                        # 简化策略：只要当前行是可用的，就开始写。写不完就换页的逻辑由下面的 grid_map 填充控制
-                        
-                        # 消耗字符
-                        text_queue.pop(0)
-                        
-                        # 确定方向
-                        if hand_mode == 'right':
-                            tpl_col, direction = 0, 1
-                        else:
-                            tpl_col, direction = cols - 1, -1
-                            
-                        # 放置范字
-                        grid_map[curr_row][tpl_col] = {'type': 'template', 'char': char}
-                        
-                        # 游标
-                        curr_write_r = curr_row
-                        curr_write_c = tpl_col + direction
-                        
-                        steps_done = 0
-                        
-                        # 笔顺填充循环
-                        stroke_finished_on_this_page = True
-                        
-                        while steps_done < total_strokes:
-                            # 换行/越界检测
-                            need_wrap = False
-                            if hand_mode == 'right' and curr_write_c >= cols: need_wrap = True
-                            if hand_mode == 'left' and curr_write_c < 0: need_wrap = True
-                            
-                            if need_wrap:
-                                curr_write_r += 1
-                                curr_write_c = 0 if hand_mode == 'right' else (cols - 1)
-                            
-                            # 如果写着写着，超出了当前页的行数
-                            if curr_write_r >= rows:
-                                # 这里的处理比较棘手。如果一个字跨页了，这在字帖里通常是不被接受的。
-                                # 理想情况：如果当前页写不下这个字，就应该回滚，把这个字放到下一页。
-                                # 但为了代码简洁，且考虑到“跨页笔顺”极少见（除非字特别复杂且到了页尾），
-                                # 这里我们选择：截断。剩下的笔画不显示了（因为下一页会重头开始新字）。
-                                # 或者，如果这是该字的“刚开始”就跨页了，说明上一行刚结束，这一行不够写。
-                                # 改进：如果 text_queue 还有很多，可以接受截断。
-                                stroke_finished_on_this_page = False
-                                break 
-                            
-                            grid_map[curr_write_r][curr_write_c] = {'type': 'step', 'char': char, 'step': steps_done}
-                            curr_write_c += direction
-                            steps_done += 1
-                        
-                        # 填充剩余
-                        if stroke_finished_on_this_page and curr_write_r < rows:
-                            while 0 <= curr_write_c < cols:
-                                grid_map[curr_write_r][curr_write_c] = {'type': fill_rest, 'char': char}
-                                curr_write_c += direction
-                        
-                        # 更新大循环的行索引
-                        curr_row = curr_write_r + 1
-                    
-                    # --- 情况 3: 普通练习模式 ---
-                    else:
-                        text_queue.pop(0) # 消耗
-                        
-                        if params['hand_mode'] == 'left':
-                            tpl_col = cols - 1
-                            practice_range = range(cols - 2, -1, -1)
-                        else:
-                            tpl_col = 0
-                            practice_range = range(1, cols)
-                        
-                        # 范字
-                        grid_map[curr_row][tpl_col] = {'type': 'template', 'char': char}
-                        
-                        # 练习格
-                        for c in practice_range:
-                            p_mode = params['practice_mode']
-                            is_trace = True
-                            dist = abs(c - tpl_col) - 1
-                            if p_mode == "一半描红" and dist >= (cols-1)//2: is_trace = False
-                            if p_mode == "临摹": is_trace = False
-                            
-                            grid_map[curr_row][c] = {'type': 'trace' if is_trace else 'empty', 'char': char}
-                        
-                        curr_row += 1
-
-                # ================= 开始绘图 (生成单页) =================
-                fig = self._render_page(config, params, grid_map, page_num)
-                pdf.savefig(fig, bbox_inches='tight', pad_inches=0)
-                plt.close(fig)
-                
-                page_num += 1
-                
-                # 退出条件
-                if not text_queue:
-                    break
-                # 保护：如果是单页模式，强制退出（只生成一页，多余截断）
-                if not params['is_multipage']:
-                    break
-
-    def _render_page(self, config, params, grid_map, page_num):
-        """
-        渲染单页内容的辅助函数
+        if is_stroke_mode:
+            start = time.perf_counter()
+            self.stroke_mgr.load_data()
+            if trace is not None: trace.add_stage('load', time.perf_counter() - start)
+
+        engine = LayoutEngine(config, params, self.stroke_mgr.stroke_count)
+        job.layout_engine = engine
+        pages = engine.iter_pages(iter_text_chars(params, config))
+        if trace is not None: pages = trace.timed_layout(pages)
+
+        # 流式模式: 排好一页就渲染并写出一页，不预先收集全部页面 (进度回调的总页数为 None)，
+        # 因此不并行，也不走页面缓存 (合并时整份文档都在内存中)
+        streaming = params.get('streaming', False)
+
+        fmt = output_format_of(params)
+        if fmt in ('png', 'tiff'):
+            if job.callback is not None and not streaming: pages = job.collect_layout(pages)
+            self._write_pages_raster(config, params, pages, fmt, job)
+            return
+
+        backend = params.get('backend', 'matplotlib')
+        workers = 1 if streaming else (params.get('workers') or 1)
+
+        # 并行模式需要先完成全部分页；有进度回调时也先排版，以便报告总页数
+        if (workers > 1 and backend != 'pdf') or (job.callback is not None and not streaming):
+            pages = job.collect_layout(pages)
+
+        if workers > 1 and backend != 'pdf':
+            workers = _parallel_workers(workers, len(pages))
+        if workers > 1 and backend != 'pdf':
+            if HAS_PYPDF:
+                self._write_pages_parallel(config, params, pages, workers, job)
+                return
+            print("提示: 未安装 pypdf，无法并行生成，改为逐页生成")
+
+        if backend == 'pdf':
+            self._write_pages_vector(config, params, pages, job)
+            return
+
+        if self.page_cache is not None and HAS_PYPDF and not streaming:
+            self._write_pages_cached(config, params, pages, job)
+            return
+
+        with _pdf_font_type(params.get('pdf_fonttype', 3)):
+            with PdfPages(params['output_file']) as pdf:
+                self._write_pages(pdf, config, params, pages, job=job)
+                # 关闭时才写入字体 (Type 42 在这一步子集化) 与交叉引用表，单独计为 finalize 阶段
+                close_start = time.perf_counter()
+            if job.trace is not None:
+                job.trace.add_finalize(time.perf_counter() - close_start, os.path.getsize(params['output_file']))
+
+    def _write_pages(self, pdf, config, params, pages, first_page_num=1, job=None):
+        total = len(pages) if isinstance(pages, list) else None
+        trace = job.trace if job is not None else None
+        for i, grid_map in enumerate(pages):
+            if job is not None: job.check()
+            if trace is not None: trace.start_page(first_page_num + i)
+            fig = self._render_page(config, params, grid_map, first_page_num + i)
+            if trace is not None: trace.mark_drawn(len(fig.axes[0].get_children()))
+            if job is not None: job.report('render', i + 1, total)
+            pdf.savefig(fig, bbox_inches='tight', pad_inches=0)
+            if trace is not None: trace.end_page(_pdf_bytes_written(pdf))
+            if job is not None: job.report('write', i + 1, total)
+
+    def _page_cache_base(self, config, params):
         """
-        # 重新计算可用区域
-        top_limit = config['height'] - config['margin_y'] - config['title_space']
-        bottom_limit = config['margin_y'] + 0.3
-        available_h = top_limit - bottom_limit
-        available_w = config['width'] - (2 * config['margin_x'])
-        
-        # 格子大小计算
-        size_type = params.get('grid_size_type', 'auto')
-        if size_type == 'fixed':
-            try: cell_size = float(params.get('grid_size_val')) / 2.54
-            except: cell_size = 1.5 / 2.54
-        else:
-            cell_w = available_w / config['cols']
-            cell_h = available_h / config['rows']
-            cell_size = min(cell_w, cell_h)
+        一份文档各页共用的缓存键部分: 版式与样式参数、字体文件、笔顺数据版本与渲染代码版本
+        """
+        style = {k: v for k, v in params.items() if k not in PAGE_CACHE_IGNORED}
+        font_file = GlyphCache.font_file(FONT_REGISTRY.get(params.get('font_path')))
+        try:
+            st = os.stat(font_file)
+            font_version = (font_file, st.st_size, st.st_mtime_ns)
+        except OSError:
+            font_version = (font_file, None, None)
+        base = [PAGE_CACHE_VERSION, matplotlib.__version__, self.DPI,
+                config, style, font_version, self.stroke_mgr.data_version()]
+        return json.dumps(base, sort_keys=True, ensure_ascii=False, default=str)
 
-        real_grid_width = cell_size * config['cols']
-        real_grid_height = cell_size * config['rows']
-        actual_margin_x = (config['width'] - real_grid_width) / 2
-        
-        # 对齐
-        align_mode = params.get('align_mode', 'center')
-        if align_mode == 'top': start_y = top_limit - real_grid_height
-        else: start_y = bottom_limit + (available_h - real_grid_height) / 2
-        if start_y < bottom_limit: start_y = top_limit - real_grid_height
+    def _write_pages_cached(self, config, params, pages, job):
+        """
+        逐页查页面缓存: 命中的页直接使用缓存的单页 PDF，未命中的页单独渲染成单页 PDF 并存入缓存，
+        最后按页序合并。缓存的页不含页脚 (页脚里有页码)，键为 版式/样式 + 是否画标题 + 本页 grid_map
+        的 SHA-256，与页码无关: 只改动少数字时内容没变的页不再渲染，整页插入或删除后其余的页也照样命中。
+        各页页脚最后集中画进同一份 PDF (字体只嵌入一次)，再叠加到对应的页上；
+        合并后去掉各页 PDF 之间重复的对象 (同一字形的 Type 3 字形过程等)
+        """
+        total = len(pages) if isinstance(pages, list) else None
+        trace = job.trace
+        template = self.get_page_template(config, params)
+        fonttype = params.get('pdf_fonttype', 3)
+        base = self._page_cache_base(config, params)
+        writer = PdfWriter()
+        boxes = []
+        merge_time = 0.0
+        for i, grid_map in enumerate(pages):
+            job.check()
+            page_num = i + 1
+            if trace is not None: trace.start_page(page_num)
+            draw_title = self._should_draw_title(config, params, page_num)
+            plan = json.dumps(grid_map, sort_keys=True, ensure_ascii=False)
+            key = hashlib.sha256(f"{base}\n{draw_title}\n{plan}".encode('utf-8')).hexdigest()
+            entry = self.page_cache.get(key)
+            if trace is not None: trace.mark_page_cache(entry is not None)
+            if entry is None:
+                fig = self._render_page(config, params, grid_map, page_num, footer=False)
+                if trace is not None: trace.mark_drawn(len(fig.axes[0].get_children()))
+                # 页面范围按含页脚的整页计算 (即不用缓存时 bbox_inches='tight' 的结果)，叠加的页脚与之对齐
+                footer = self.draw_page_footer(fig.axes[0], params, template, page_num)
+                box = fig.get_tightbbox()
+                footer.remove()
+                buf = io.BytesIO()
+                with _pdf_font_type(fonttype), PdfPages(buf) as pdf:
+                    pdf.savefig(fig, bbox_inches=box, pad_inches=0)
+                # 缓存内容: 首行为页面范围 (英寸)，其后是单页 PDF
+                entry = ' '.join(repr(float(v)) for v in box.extents).encode('ascii') + b'\n' + buf.getvalue()
+                self.page_cache.put(key, entry)
+            job.report('render', page_num, total)
+            header, page_pdf = entry.split(b'\n', 1)
+            x0, y0, x1, y1 = map(float, header.split())
+            boxes.append(Bbox([[x0, y0], [x1, y1]]))
+            merge_start = time.perf_counter()
+            writer.append(io.BytesIO(page_pdf))
+            merge_time += time.perf_counter() - merge_start
+            if trace is not None: trace.end_page()
+            job.report('write', page_num, total)
+
+        merge_start = time.perf_counter()
+        overlay = io.BytesIO()
+        with _pdf_font_type(fonttype), PdfPages(overlay) as pdf:
+            for i, box in enumerate(boxes):
+                fig, ax = self._new_page_figure(config)
+                self.draw_page_footer(ax, params, template, i + 1)
+                # 叠加层不画白色背景，否则会盖住下面的页面内容
+                pdf.savefig(fig, bbox_inches=box, pad_inches=0, transparent=True)
+        for page, footer_page in zip(writer.pages, PdfReader(overlay).pages):
+            page.merge_page(footer_page)
+            # merge_page 重写后的内容流未压缩，重新压缩，否则笔顺页的文件会大几倍
+            page.compress_content_streams()
+        _dedupe_pdf_objects(writer)
+        with open(params['output_file'], 'wb') as f:
+            writer.write(f)
+        if trace is not None: trace.add_stage('merge', merge_time + time.perf_counter() - merge_start)
+
+    def _write_pages_parallel(self, config, params, pages, workers, job):
+        """
+        将已排好的页面按连续区段分给进程池渲染，每段生成一份 PDF，最后按页序合并。
+        pypdf 合并时不会合并各段的字体子集，每段各嵌一份、各做一次子集化，
+        因此每个进程只分一段: 区段越多，子集化的总耗时越长；合并后去掉各段之间重复的对象 (同一字形的字形过程等)
+        """
+        chunk = max(1, math.ceil(len(pages) / workers))
+        shards = [(start + 1, pages[start:start + chunk]) for start in range(0, len(pages), chunk)]
 
-        # 初始化绘图
-        plt.rcParams['font.sans-serif'] = ['SimHei'] 
-        fig, ax = plt.subplots(figsize=(config['width'], config['height']), dpi=self.DPI)
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker,
+                                   initargs=(self.stroke_mgr.cache_size,))
+        try:
+            futures = [pool.submit(_render_shard, config, params, first, shard) for first, shard in shards]
+            writer = PdfWriter()
+            rendered = 0
+            merge_time = 0.0
+            loop_start = time.perf_counter()
+            for future in futures:
+                # 按提交顺序取结果，保证页序
+                while True:
+                    job.check()
+                    try:
+                        pdf_bytes = future.result(timeout=0.2)
+                        break
+                    except FuturesTimeout:
+                        continue
+                merge_start = time.perf_counter()
+                writer.append(io.BytesIO(pdf_bytes))
+                merge_time += time.perf_counter() - merge_start
+                rendered += chunk
+                job.report('render', min(rendered, len(pages)), len(pages))
+        except BaseException:
+            # 正在渲染的区段无法中断，不再等待，排队中的区段直接取消
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+        write_start = time.perf_counter()
+        _dedupe_pdf_objects(writer)
+        with open(params['output_file'], 'wb') as f:
+            writer.write(f)
+        if job.trace is not None:
+            # 页面在工作进程中渲染，只能分别记录等待渲染与合并写出的总耗时
+            job.trace.add_stage('render', write_start - loop_start - merge_time)
+            job.trace.add_stage('merge', merge_time + time.perf_counter() - write_start)
+        job.report('write', len(pages), len(pages))
+
+    def _write_pages_vector(self, config, params, pages, job):
+        total = len(pages) if isinstance(pages, list) else None
+        with PdfDocument(params['output_file']) as doc:
+            writer = VectorPageWriter(doc, self.stroke_mgr, self.glyph_cache, config, params,
+                                      self.get_page_template(config, params))
+            for i, grid_map in enumerate(pages):
+                job.check()
+                if job.trace is not None: job.trace.start_page(i + 1)
+                writer.write_page(grid_map, i + 1, self._should_draw_title(config, params, i + 1))
+                # 矢量后端边绘制边写入，耗时全部计入 draw
+                if job.trace is not None: job.trace.end_page(doc.tell())
+                job.report('render', i + 1, total)
+                job.report('write', i + 1, total)
+            close_start = time.perf_counter()
+        if job.trace is not None:
+            job.trace.add_finalize(time.perf_counter() - close_start, os.path.getsize(params['output_file']))
+
+    def _write_pages_raster(self, config, params, pages, fmt, job):
+        total = len(pages) if isinstance(pages, list) else None
+        trace = job.trace
+        writer = RasterPageWriter(self, config, params, self.get_page_template(config, params),
+                                  params.get('raster_dpi') or 300)
+        dpi = (writer.dpi, writer.dpi)
+        output_file = params['output_file']
+        tiff = TiffImagePlugin.AppendingTiffWriter(output_file, True) if fmt == 'tiff' else None
+        written = 0
+        try:
+            for i, grid_map in enumerate(pages):
+                job.check()
+                if trace is not None: trace.start_page(i + 1)
+                buf, n_artists = writer.render(grid_map, i + 1)
+                if trace is not None: trace.mark_drawn(n_artists)
+                job.report('render', i + 1, total)
+
+                image = writer.image(buf)
+                if tiff is not None:
+                    image.save(tiff, format='TIFF', compression='tiff_deflate', dpi=dpi)
+                    tiff.newFrame()
+                    written = tiff.f.tell()
+                else:
+                    path = raster_page_path(output_file, i + 1) if params['is_multipage'] else output_file
+                    image.save(path + '.part', format='PNG', dpi=dpi)
+                    os.replace(path + '.part', path)
+                    written += os.path.getsize(path)
+                if trace is not None: trace.end_page(written)
+                job.report('write', i + 1, total)
+        finally:
+            close_start = time.perf_counter()
+            if tiff is not None: tiff.close()
+        if trace is not None and tiff is not None:
+            trace.add_finalize(time.perf_counter() - close_start, os.path.getsize(output_file))
+
+    def _should_draw_title(self, config, params, page_num):
+        if not config['has_title']: return False
+        if params['is_multipage']:
+            return params['title_every_page'] or page_num == 1
+        return True
+
+    def _new_page_figure(self, config):
+        # 每页独立的 Figure 与画布，不经过 pyplot 的全局图形管理，多个线程可以同时渲染。
+        # 字体由 PageTemplate 从 FONT_REGISTRY 取得，不改全局 rcParams
+        fig = Figure(figsize=(config['width'], config['height']), dpi=self.DPI)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
         ax.axis('off')
         ax.set_xlim(0, config['width'])
         ax.set_ylim(0, config['height'])
+        return fig, ax
 
-        try:
-            if params.get('font_path') and os.path.exists(params['font_path']):
-                my_font = FontProperties(fname=params['font_path'])
-            else: my_font = FontProperties(family='sans-serif')
-        except: my_font = FontProperties(family='sans-serif')
+    def _render_page(self, config, params, grid_map, page_num, footer=True):
+        """
+        渲染单页内容的辅助函数。footer=False 时不画页脚 (页面缓存另行叠加)
+        """
+        template = self.get_page_template(config, params)
+        fig, ax = self._new_page_figure(config)
+        template.draw(ax)
+        self.draw_page_cells(ax, config, params, template, grid_map)
+        self.draw_page_text(ax, config, params, template, page_num, footer)
+        return fig
+
+    def draw_page_cells(self, ax, config, params, template, grid_map, glyph_paths=False):
+        """
+        绘制一页的格子内容 (范字、笔顺、描红)，不含网格背景
+        glyph_paths: 字体字形改用 GlyphCache 的缓存轮廓盖印，适合栅格输出 (预览、PNG)；
+            PDF 输出仍用 ax.text，嵌入字体后每个字形在整份文档中只写一次，文件小得多
+        """
+        cell_size = template.cell_size
+        my_font = template.font
+        # 每页取一次行列坐标表，逐格只按下标取值
+        cell_x, cell_y = template.cell_x.tolist(), template.cell_y.tolist()
+        center_x, center_y = template.center_x.tolist(), template.center_y.tolist()
+        glyph_y = template.glyph_y.tolist()
 
         TRACE_COLOR = '#D3D3D3'
-        rows, cols = config['rows'], config['cols']
+        fontsize = (cell_size * 0.8) * 72
+        is_stroke_mode = (params.get('practice_mode') == "笔顺分解")
+        # 内容相同的格子归组，整页结束后每组只构建一次再平移盖印到各格:
+        # 笔画格按 (字, 笔数, 颜色)，用字体字形绘制的格子按 (字, 颜色)
+        stroke_cells = {}
+        glyph_cells = {}
 
-        for r in range(rows):
-            y = start_y + (rows - 1 - r) * cell_size
-            for c in range(cols):
-                x = actual_margin_x + c * cell_size
-                
-                # 背景
-                rect = patches.Rectangle((x, y), cell_size, cell_size, linewidth=0.8, 
-                                       edgecolor=params['grid_color'], facecolor='none')
-                ax.add_patch(rect)
-                
-                cx, cy = x + cell_size/2, y + cell_size/2
-                style = {'color': params['grid_color'], 'linestyle': ':', 'linewidth': 0.5, 'alpha': 0.6}
-                if params['grid_style'] in ["米字格", "田字格"]:
-                    ax.plot([x, x+cell_size], [cy, cy], **style)
-                    ax.plot([cx, cx], [y, y+cell_size], **style)
-                if params['grid_style'] == "米字格":
-                    ax.plot([x, x+cell_size], [y, y+cell_size], **style)
-                    ax.plot([x, x+cell_size], [y+cell_size, y], **style)
-
-                cell_data = grid_map[r][c]
+        for r, row in enumerate(grid_map):
+            for c, cell_data in enumerate(row):
                 if not cell_data: continue
-                
+
                 ctype = cell_data['type']
                 char = cell_data.get('char', '')
-                fontsize = (cell_size * 0.8) * 72
-                
+
                 # 绘图逻辑
-                is_stroke_mode = (params.get('practice_mode') == "笔顺分解")
-                
-                if ctype == 'template':
-                    success = False
-                    if is_stroke_mode: 
-                        success = self.stroke_mgr.draw_char_strokes(ax, char, x, y, cell_size, color='black')
-                    if not success:
-                        ax.text(cx, cy - cell_size*0.05, char, fontproperties=my_font, 
-                                fontsize=fontsize, ha='center', va='center', color='black')
-                
-                elif ctype == 'step':
-                    success = self.stroke_mgr.draw_char_strokes(ax, char, x, y, cell_size, 
-                                                                step_index=cell_data['step'], 
-                                                                color=TRACE_COLOR, guide_color=None)
-                    if not success:
-                        ax.text(cx, cy, "?", color='red', ha='center', va='center') 
-
-                elif ctype == 'trace':
-                    success = False
+                if ctype == 'template' or ctype == 'trace':
+                    color = 'black' if ctype == 'template' else TRACE_COLOR
                     if is_stroke_mode:
-                        success = self.stroke_mgr.draw_char_strokes(ax, char, x, y, cell_size, 
-                                                                    step_index=None, color=TRACE_COLOR)
-                    if not success:
-                        ax.text(cx, cy - cell_size*0.05, char, fontproperties=my_font, 
-                                fontsize=fontsize, ha='center', va='center', color=TRACE_COLOR)
+                        stroke_cells.setdefault((char, None, color), []).append((r, c))
+                    else:
+                        glyph_cells.setdefault((char, color), []).append((center_x[c], glyph_y[r]))
 
-        # 标题绘制逻辑
-        should_draw_title = False
-        if config['has_title']:
-            if params['is_multipage']:
-                if params['title_every_page']: should_draw_title = True
-                elif page_num == 1: should_draw_title = True
+                elif ctype == 'step':
+                    stroke_cells.setdefault((char, cell_data['step'], TRACE_COLOR), []).append((r, c))
+
+        for (char, step, color), cells in stroke_cells.items():
+            corners = [(cell_x[c], cell_y[r]) for r, c in cells]
+            if self.stroke_mgr.stamp_char_strokes(ax, char, corners, cell_size, step_index=step, color=color):
+                continue
+            # 没有笔顺数据: 范字与描红改用字体字形，笔顺格标红色问号
+            for r, c in cells:
+                if step is None:
+                    glyph_cells.setdefault((char, color), []).append((center_x[c], glyph_y[r]))
+                else:
+                    ax.text(center_x[c], center_y[r], "?", color='red', ha='center', va='center')
+
+        for (char, color), centers in glyph_cells.items():
+            if glyph_paths:
+                # 轮廓只转换一次，之后按变换盖印 (等同 ax.text 居中绘制)
+                self.glyph_cache.stamp(ax, my_font, char, centers, fontsize, color)
             else:
-                should_draw_title = True
+                for cx, cy in centers:
+                    ax.text(cx, cy, char, fontproperties=my_font,
+                            fontsize=fontsize, ha='center', va='center', color=color)
 
-        if should_draw_title:
+    def draw_page_text(self, ax, config, params, template, page_num, footer=True):
+        """
+        绘制标题与页脚
+        """
+        # 标题绘制逻辑
+        if self._should_draw_title(config, params, page_num):
             title = params['custom_title'] if params['custom_title'] else "标题"
-            title_y = config['height'] - config['margin_y'] - (config['title_space'] / 2) + 0.1
-            plt.text(config['width']/2, title_y, title, fontproperties=my_font, fontsize=config['title_size'], ha='center', va='center')
-        
-        # 页脚
-        if size_type == 'fixed': size_str = f"{params.get('grid_size_val')}cm"
-        else: size_str = f"约{cell_size * 2.54:.1f}cm"
-        grid_info = f"{config['rows']}行×{config['cols']}列 ({size_str}/格)"
-        
-        # 多页页码
+            ax.text(*template.title_pos, title, fontproperties=template.font, fontsize=config['title_size'], ha='center', va='center')
+        if footer: self.draw_page_footer(ax, params, template, page_num)
+
+    def draw_page_footer(self, ax, params, template, page_num):
+        # 页脚 (多页页码)
         page_info = f" - 第 {page_num} 页" if params['is_multipage'] else ""
-        note = f"字帖生成器{page_info} - {grid_info}"
-        plt.text(config['width']/2, 0.3, note, fontproperties=my_font, fontsize=10, ha='center', va='center', color='gray')
+        note = f"字帖生成器{page_info} - {template.grid_info}"
+        return ax.text(*template.footer_pos, note, fontproperties=template.font, fontsize=10, ha='center', va='center', color='gray')
+
+
+# ==========================================
+# 并行渲染的工作进程 (需为模块级函数以便 pickle)
+# ==========================================
+_worker_generator = None
+
+def _init_render_worker(stroke_cache_size):
+    # 每个工作进程只初始化一次生成器，笔顺数据与字体在进程内复用
+    global _worker_generator
+    _worker_generator = CopybookGenerator(stroke_cache_size=stroke_cache_size)
 
-        return fig
\ No newline at end of file
+def _render_shard(config, params, first_page_num, pages):
+    buf = io.BytesIO()
+    with _pdf_font_type(params.get('pdf_fonttype', 3)), PdfPages(buf) as pdf:
+        _worker_generator._write_pages(pdf, config, params, pages, first_page_num)
+    return buf.getvalue()
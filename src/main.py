@@ -3,19 +3,25 @@ from tkinter import filedialog, messagebox, scrolledtext, ttk
 import tkinter.font as tkfont
 import os
 import sys
+import queue
+import threading
 
 # 解决模块导入问题
 sys.path.append(os.path.dirname(__file__))
-from generator import CopybookGenerator
+# generator.py (matplotlib、numpy 等) 较慢，窗口显示后才在后台线程中导入，见 warm_up_engine
+from defaults import GRID_COLORS
+from preview import PreviewPane
 
 class App:
     def __init__(self, root):
         self.root = root
         self.root.title("汉字字帖生成器 v2.2 - 多页版")
         self.root.minsize(1000, 850)
-        self.root.geometry("1100x920")
+        # 屏幕够宽时默认显示右侧预览 (窗口约宽 460 像素)，1366 等较窄的屏幕默认隐藏，可在顶部勾选
+        self.show_preview = tk.BooleanVar(value=self.root.winfo_screenwidth() >= 1560)
+        self.root.geometry("1560x920" if self.show_preview.get() else "1100x920")
         
-        self.generator = CopybookGenerator()
+        self.generator = None   # 绘图引擎在后台加载完成后才可用
         
         # --- 路径处理 ---
         current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -37,6 +43,8 @@ class App:
         self.grid_size_str = tk.StringVar(value="自动 (填满版面)")
         
         self.fill_page = tk.BooleanVar(value=True)
+        self.use_page_cache = tk.BooleanVar(value=False)
+        self.page_cache = None
         self.stroke_rest_mode = tk.StringVar(value="剩余描红") 
 
         # 新增变量
@@ -50,6 +58,7 @@ class App:
         self.custom_size_val = tk.DoubleVar(value=1.2)
         
         self.ui_scale = tk.DoubleVar(value=1.0)
+        self.worker_thread = None
         
         self.base_font_size = 10
         self.text_font_size = 12
@@ -60,10 +69,18 @@ class App:
         self.on_size_change(None)
         self.on_mode_change(None) 
         self.on_page_mode_change()
+        self.toggle_preview()
+        self.bind_preview()
+        # 先让窗口显示出来，再开始加载绘图引擎
+        self.root.after(100, self.warm_up_engine)
 
     def create_widgets(self):
+        # ================== 右侧实时预览 ==================
+        self.preview = PreviewPane(self.root, self.generator, self.preview_params, width=440)
+
         main_frame = tk.Frame(self.root, padx=20, pady=20)
-        main_frame.pack(fill="both", expand=True)
+        main_frame.pack(side="left", fill="both", expand=True)
+        self.main_frame = main_frame
 
         # ================== 顶部缩放 ==================
         frame_scale = tk.Frame(main_frame)
@@ -74,6 +91,8 @@ class App:
                                 command=self.update_ui_scale)
         scale_slider.set(1.0)
         scale_slider.pack(side="left", padx=10)
+        tk.Checkbutton(frame_scale, text="显示实时预览", variable=self.show_preview,
+                       command=self.toggle_preview).pack(side="left", padx=(20, 0))
 
         # ================== 基础设置 ==================
         frame_basic = tk.LabelFrame(main_frame, text="基础布局设置", padx=15, pady=15)
@@ -173,6 +192,10 @@ class App:
         tk.Label(f_page_set, text="|  版面对齐:").pack(side="left", padx=(15, 5))
         ttk.Combobox(f_page_set, textvariable=self.align_mode, values=["居中", "顶部"], width=8, state="readonly").pack(side="left")
 
+        # 页面缓存默认关闭: 未命中的页要单独保存 (每页各嵌一份字体子集)，首次生成更慢、文件更大，
+        # 只在反复修改同一份字帖时才划算
+        tk.Checkbutton(f_page_set, text="复用未变化的页", variable=self.use_page_cache).pack(side="left", padx=(15, 0))
+
         # 第二排：标题与生成
         f_title_gen = tk.Frame(frame_bot)
         f_title_gen.pack(fill="x", pady=(5, 0))
@@ -187,9 +210,86 @@ class App:
         tk.Label(self.frame_title_mode, text="显示:").pack(side="left")
         ttk.Combobox(self.frame_title_mode, textvariable=self.title_display_mode, values=["每页显示", "仅首页"], width=8, state="readonly").pack(side="left")
         
-        tk.Button(f_title_gen, text="生成 PDF 字帖", command=self.generate, 
+        self.btn_generate = tk.Button(f_title_gen, text="生成 PDF 字帖", command=self.generate, 
                   bg="#007AFF", fg="white", 
-                  width=18, height=1, relief="flat").pack(side="right")
+                  width=18, height=1, relief="flat", state="disabled")
+        self.btn_generate.pack(side="right")
+
+        # 第三排：生成进度
+        f_progress = tk.Frame(frame_bot)
+        f_progress.pack(fill="x", pady=(8, 0))
+        self.progress_bar = ttk.Progressbar(f_progress, orient="horizontal", mode="determinate")
+        self.progress_bar.pack(side="left", fill="x", expand=True)
+        self.lbl_progress = tk.Label(f_progress, text="正在加载绘图引擎...", fg="gray", width=24, anchor="w")
+        self.lbl_progress.pack(side="left", padx=10)
+        self.btn_cancel = tk.Button(f_progress, text="取消", command=self.cancel_generate, width=8, state="disabled")
+        self.btn_cancel.pack(side="right")
+
+    def warm_up_engine(self):
+        """
+        在后台线程导入 generator.py 并预加载笔顺数据，完成前生成按钮不可用、预览显示提示。
+        加载结果通过队列交回界面线程，后台线程不直接操作控件
+        """
+        result = queue.Queue()
+
+        def worker():
+            try:
+                from generator import CopybookGenerator
+                generator = CopybookGenerator()
+                generator.stroke_mgr.load_data()
+                result.put(('ok', generator))
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                result.put(('error', str(e)))
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(50, self.poll_engine, result)
+
+    def poll_engine(self, result):
+        try: status, value = result.get_nowait()
+        except queue.Empty:
+            self.root.after(50, self.poll_engine, result)
+            return
+        if status == 'error':
+            self.lbl_progress.config(text="绘图引擎加载失败")
+            messagebox.showerror("错误", f"绘图引擎加载失败:\n{value}")
+            return
+        self.generator = value
+        self.btn_generate.config(state="normal")
+        self.lbl_progress.config(text="")
+        self.preview.attach(value)
+
+    def bind_preview(self):
+        """
+        任一参数变化都触发预览刷新 (PreviewPane 内部防抖)
+        """
+        for var in (self.font_path, self.paper_size, self.grid_style, self.hand_mode, self.practice_mode,
+                    self.align_mode, self.grid_size_str, self.fill_page, self.stroke_rest_mode, self.page_mode,
+                    self.title_display_mode, self.color_combo_val, self.custom_rows, self.custom_cols,
+                    self.has_title, self.custom_size_val):
+            var.trace_add("write", self.preview.schedule)
+        self.text_input.bind("<KeyRelease>", self.preview.schedule)
+        self.entry_title.bind("<KeyRelease>", self.preview.schedule)
+        self.preview.schedule()
+
+    def toggle_preview(self):
+        """
+        显示或收起右侧预览；收起时预览不再刷新
+        """
+        if self.show_preview.get():
+            self.preview.pack(side="right", fill="y", padx=(0, 20), pady=20, before=self.main_frame)
+        else:
+            self.preview.pack_forget()
+        self.preview.set_active(self.show_preview.get())
+
+    def preview_params(self):
+        # 后台生成期间共用同一个生成器，等生成结束后再刷新预览
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            self.preview.schedule()
+            return None
+        try: return self.collect_params(show_errors=False)
+        except tk.TclError: return None  # 输入框正在编辑 (如行数为空)
 
     def toggle_title_entry(self):
         state = "normal" if self.has_title.get() else "disabled"
@@ -266,9 +366,11 @@ class App:
         f = filedialog.askopenfilename(filetypes=[("Font", "*.ttf *.ttc *.otf")])
         if f: self.font_path.set(f)
 
-    def generate(self):
+    def collect_params(self, show_errors=True):
+        """
+        从界面控件收集生成参数，格子尺寸无效时返回 None
+        """
         text = self.text_input.get("1.0", tk.END).strip()
-        color_map = {"粉色": "#FFB6C1", "红色": "#FF0000", "灰色": "#A9A9A9", "黑色": "#000000"}
         
         hand_val = self.hand_mode.get()
         hand_code = "right" if "右手" in hand_val else "left"
@@ -291,8 +393,8 @@ class App:
             grid_size_type = "fixed"
             try: grid_size_val = self.custom_size_val.get()
             except:
-                messagebox.showerror("错误", "请输入有效的格子尺寸数值")
-                return
+                if show_errors: messagebox.showerror("错误", "请输入有效的格子尺寸数值")
+                return None
 
         title_content = self.entry_title.get().strip()
         if not title_content: title_content = "汉字练习"
@@ -303,7 +405,7 @@ class App:
             "paper_size": self.paper_size.get(),
             "hand_mode": hand_code,
             "grid_style": self.grid_style.get(),
-            "grid_color": color_map.get(self.color_combo_val.get(), "#FFB6C1"),
+            "grid_color": GRID_COLORS.get(self.color_combo_val.get(), GRID_COLORS["粉色"]),
             "practice_mode": self.practice_mode.get(),
             
             # 逻辑修改：单页模式下才允许 fill_page，多页模式下强制 false (顺序写完)
@@ -322,21 +424,103 @@ class App:
             "grid_size_type": grid_size_type,
             "grid_size_val": grid_size_val
         }
-        
+        return params
+
+    def generate(self):
+        params = self.collect_params()
+        if params is None: return
+
         default_name = f"字帖_{params['paper_size']}.pdf"
-        f = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF", "*.pdf")], initialfile=default_name)
+        # 也可保存为 PNG (每页一张) 或多页 TIFF，用于只支持图片的打印设备或网页展示
+        f = filedialog.asksaveasfilename(defaultextension=".pdf", initialfile=default_name,
+                                         filetypes=[("PDF", "*.pdf"), ("PNG 图片", "*.png"), ("TIFF 图片", "*.tif *.tiff")])
         
         if f:
+            params['output_file'] = f
+            self.start_generate(params)
+
+    # ================== 后台生成 ==================
+    def start_generate(self, params):
+        """
+        在后台线程中生成，界面线程只通过消息队列更新进度
+        """
+        self.cancel_event = threading.Event()
+        self.progress_queue = queue.Queue()
+        self.btn_generate.config(state="disabled")
+        self.btn_cancel.config(state="normal")
+        self.progress_bar.config(value=0, maximum=1)
+        self.lbl_progress.config(text="正在排版...")
+
+        def on_progress(stage, done, total):
+            self.progress_queue.put(('progress', stage, done, total))
+
+        from generator import GenerationCancelled
+        use_page_cache = self.use_page_cache.get()
+
+        def worker():
             try:
-                params['output_file'] = f
-                self.generator.generate_pdf(params)
-                messagebox.showinfo("成功", f"文件已保存:\n{f}")
-                try: os.startfile(f)
-                except: pass
+                # 页面缓存: 修改少数字后重新生成时，内容没变的页直接复用 (勾选后才启用)
+                if use_page_cache and self.page_cache is None:
+                    from page_cache import PageCache
+                    try: self.page_cache = PageCache()
+                    except OSError: pass   # 缓存目录不可写时不使用缓存
+                page_cache = self.page_cache if use_page_cache else None
+                self.generator.page_cache = page_cache
+                hits_before = page_cache.hits if page_cache is not None else 0
+                self.generator.generate_pdf(params, progress=on_progress, cancel_event=self.cancel_event)
+                reused = page_cache.hits - hits_before if page_cache is not None else 0
+                self.progress_queue.put(('done', params['output_file'], reused))
+            except GenerationCancelled:
+                self.progress_queue.put(('cancelled',))
             except Exception as e:
                 import traceback
                 traceback.print_exc() 
-                messagebox.showerror("生成失败", f"错误信息:\n{str(e)}")
+                self.progress_queue.put(('error', str(e)))
+
+        self.worker_thread = threading.Thread(target=worker, daemon=True)
+        self.worker_thread.start()
+        self.root.after(50, self.poll_progress)
+
+    def cancel_generate(self):
+        self.cancel_event.set()
+        self.btn_cancel.config(state="disabled")
+        self.lbl_progress.config(text="正在取消...")
+
+    def poll_progress(self):
+        finished = None
+        while True:
+            try: msg = self.progress_queue.get_nowait()
+            except queue.Empty: break
+            if msg[0] == 'progress':
+                _, stage, done, total = msg
+                stage_name = {"layout": "排版", "render": "渲染", "write": "写入"}[stage]
+                if total:
+                    # 排版、渲染、写入三个阶段各占进度条的一段
+                    offset = {"layout": 0, "render": 1, "write": 2}[stage]
+                    self.progress_bar.config(maximum=total * 3, value=offset * total + done)
+                    self.lbl_progress.config(text=f"{stage_name} {done}/{total} 页")
+                else:
+                    self.lbl_progress.config(text=f"{stage_name} {done} 页")
+            else:
+                finished = msg
+
+        if finished is None:
+            self.root.after(50, self.poll_progress)
+            return
+
+        self.btn_generate.config(state="normal")
+        self.btn_cancel.config(state="disabled")
+        if finished[0] == 'done':
+            self.lbl_progress.config(text=f"已完成 (复用缓存 {finished[2]} 页)" if finished[2] else "已完成")
+            messagebox.showinfo("成功", f"文件已保存:\n{finished[1]}")
+            try: os.startfile(finished[1])
+            except: pass
+        elif finished[0] == 'cancelled':
+            self.progress_bar.config(value=0)
+            self.lbl_progress.config(text="已取消")
+        else:
+            self.lbl_progress.config(text="生成失败")
+            messagebox.showerror("生成失败", f"错误信息:\n{finished[1]}")
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,113 @@
+"""
+按内容寻址的页面缓存 (磁盘)
+
+每个键 (调用方算好的 SHA-256 十六进制串) 对应缓存目录中的一个文件，内容为单页的输出 (如单页 PDF)。
+总大小超过上限时淘汰最久未用的页。文件的修改时间即最近使用时间，命中时会刷新，
+因此 LRU 顺序在进程重启后依然有效；多个进程共用同一目录时，被别的进程淘汰的页按未命中处理。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+# 默认缓存目录: 项目根目录下的 cache/pages
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'pages')
+
+
+class PageCache:
+    SUFFIX = '.page'
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=256 * 1024 * 1024):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries = OrderedDict()   # 键 -> 字节数，最久未用的在前
+        self._lock = threading.Lock()
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.SUFFIX): continue
+            try: st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError: continue
+            found.append((st.st_mtime, name[:-len(self.SUFFIX)], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.total_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+    def get(self, key):
+        """
+        取缓存的内容，未命中返回 None
+        """
+        with self._lock:
+            known = key in self._entries
+        data = None
+        if known:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError:
+                data = None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                if known: self._forget(key)
+                return None
+            if key in self._entries: self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        # 先写临时文件再替换，其他线程或进程不会读到写了一半的页
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        evicted = []
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = len(data)
+            self.total_bytes += len(data)
+            # 至少保留刚写入的一页
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self.total_bytes -= size
+                self.evictions += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            try: os.remove(self._path(old_key))
+            except OSError: pass
+
+    def _forget(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None: self.total_bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "entries": len(self._entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes,
+                "evictions": self.evictions
+            }
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+            self._entries.clear()
+            self.total_bytes = 0
+        for key in keys:
+            try: os.remove(self._path(key))
+            except OSError: pass
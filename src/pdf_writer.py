@@ -0,0 +1,195 @@
+"""
+直接输出矢量 PDF 的轻量写入器
+
+不经过 matplotlib 的 Figure/艺术家体系，直接把网格线、笔画 Path、字形轮廓
+写成 PDF 路径操作符。对象边生成边写入文件，只在内存中保留各对象的偏移量。
+可复用的内容 (整页背景、每个不同的字) 写成 Form XObject，页面里只做引用。
+"""
+import zlib
+
+from matplotlib.colors import to_rgb
+from matplotlib.path import Path
+from matplotlib.transforms import Affine2D
+
+
+def _num(v):
+    # 保留 4 位小数并去掉多余的 0，控制内容流体积
+    s = f"{v:.4f}".rstrip('0').rstrip('.')
+    return s if s not in ('-0', '') else '0'
+
+
+class PdfContent:
+    """
+    单个内容流 (页面或 Form XObject) 的操作符构建器
+    """
+    def __init__(self):
+        self.parts = []
+        self.xobjects = {}      # 资源名 -> 对象号
+        self.ext_gstates = {}   # 资源名 -> 对象号
+
+    def op(self, *args):
+        self.parts.append(' '.join(a if isinstance(a, str) else _num(a) for a in args))
+
+    def save(self): self.parts.append('q')
+    def restore(self): self.parts.append('Q')
+
+    def concat(self, a, b, c, d, e, f):
+        self.op(a, b, c, d, e, f, 'cm')
+
+    def fill_color(self, color):
+        self.op(*to_rgb(color), 'rg')
+
+    def stroke_color(self, color):
+        self.op(*to_rgb(color), 'RG')
+
+    def line_width(self, w):
+        self.op(w, 'w')
+
+    def dash(self, pattern, phase=0):
+        self.parts.append('[' + ' '.join(_num(v) for v in pattern) + '] ' + _num(phase) + ' d')
+
+    def ext_gstate(self, name, obj_id):
+        self.ext_gstates[name] = obj_id
+        self.parts.append(f'/{name} gs')
+
+    def rect(self, x, y, w, h):
+        self.op(x, y, w, h, 're')
+
+    def line(self, x0, y0, x1, y1):
+        self.op(x0, y0, 'm')
+        self.op(x1, y1, 'l')
+
+    def path(self, path, matrix=None):
+        """
+        追加一个 matplotlib Path，二次贝塞尔转换为三次贝塞尔
+        """
+        transform = Affine2D(matrix) if matrix is not None else None
+        cur = (0.0, 0.0)
+        start = (0.0, 0.0)
+        for verts, code in path.iter_segments(transform, simplify=False, curves=True):
+            if code == Path.MOVETO:
+                cur = start = (verts[0], verts[1])
+                self.op(verts[0], verts[1], 'm')
+            elif code == Path.LINETO:
+                cur = (verts[0], verts[1])
+                self.op(verts[0], verts[1], 'l')
+            elif code == Path.CURVE3:
+                qx, qy, x, y = verts
+                c1x, c1y = cur[0] + 2.0 / 3.0 * (qx - cur[0]), cur[1] + 2.0 / 3.0 * (qy - cur[1])
+                c2x, c2y = x + 2.0 / 3.0 * (qx - x), y + 2.0 / 3.0 * (qy - y)
+                self.op(c1x, c1y, c2x, c2y, x, y, 'c')
+                cur = (x, y)
+            elif code == Path.CURVE4:
+                self.op(*verts, 'c')
+                cur = (verts[4], verts[5])
+            elif code == Path.CLOSEPOLY:
+                self.parts.append('h')
+                cur = start
+
+    def fill(self): self.parts.append('f')
+    def stroke(self): self.parts.append('S')
+
+    def draw_xobject(self, name, obj_id, matrix=None):
+        self.xobjects[name] = obj_id
+        if matrix is not None:
+            self.save()
+            self.concat(*matrix)
+            self.parts.append(f'/{name} Do')
+            self.restore()
+        else:
+            self.parts.append(f'/{name} Do')
+
+    def resources(self):
+        res = []
+        if self.xobjects:
+            res.append('/XObject << ' + ' '.join(f'/{k} {v} 0 R' for k, v in self.xobjects.items()) + ' >>')
+        if self.ext_gstates:
+            res.append('/ExtGState << ' + ' '.join(f'/{k} {v} 0 R' for k, v in self.ext_gstates.items()) + ' >>')
+        return '<< ' + ' '.join(res) + ' >>'
+
+    def getvalue(self):
+        return '\n'.join(self.parts).encode('latin-1')
+
+
+class PdfDocument:
+    """
+    流式 PDF 文件写入器: 对象写出后即释放，关闭时补写页树、目录与交叉引用表
+    """
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._offsets = [None]
+        self._page_ids = []
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self.pages_id = self.alloc()
+
+    def _write(self, data):
+        self._file.write(data)
+
+    def tell(self):
+        """已写入的字节数"""
+        return self._file.tell()
+
+    def alloc(self):
+        self._offsets.append(None)
+        return len(self._offsets) - 1
+
+    def write_object(self, obj_id, body):
+        if isinstance(body, str): body = body.encode('latin-1')
+        self._offsets[obj_id] = self._file.tell()
+        self._write(b'%d 0 obj\n' % obj_id + body + b'\nendobj\n')
+
+    def write_stream(self, obj_id, data, extra=''):
+        data = zlib.compress(data, 6)
+        head = f'<< {extra} /Length {len(data)} /Filter /FlateDecode >>\nstream\n'.encode('latin-1')
+        self.write_object(obj_id, head + data + b'\nendstream')
+
+    def add_ext_gstate(self, alpha):
+        obj_id = self.alloc()
+        self.write_object(obj_id, f'<< /Type /ExtGState /CA {_num(alpha)} /ca {_num(alpha)} >>')
+        return obj_id
+
+    def add_form(self, content, bbox):
+        """
+        写入一个 Form XObject，BBox 之外的内容会被裁掉
+        """
+        obj_id = self.alloc()
+        extra = '/Type /XObject /Subtype /Form /BBox [' + ' '.join(_num(v) for v in bbox) + \
+                '] /Resources ' + content.resources()
+        self.write_stream(obj_id, content.getvalue(), extra)
+        return obj_id
+
+    def add_page(self, content, width_pt, height_pt):
+        content_id = self.alloc()
+        self.write_stream(content_id, content.getvalue())
+        page_id = self.alloc()
+        self.write_object(page_id, f'<< /Type /Page /Parent {self.pages_id} 0 R '
+                                   f'/MediaBox [0 0 {_num(width_pt)} {_num(height_pt)}] '
+                                   f'/Resources {content.resources()} /Contents {content_id} 0 R >>')
+        self._page_ids.append(page_id)
+        return page_id
+
+    def close(self):
+        kids = ' '.join(f'{i} 0 R' for i in self._page_ids)
+        self.write_object(self.pages_id, f'<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>')
+        catalog_id = self.alloc()
+        self.write_object(catalog_id, f'<< /Type /Catalog /Pages {self.pages_id} 0 R >>')
+
+        xref_pos = self._file.tell()
+        lines = [f'xref\n0 {len(self._offsets)}\n', '0000000000 65535 f \n']
+        for off in self._offsets[1:]:
+            lines.append(f'{off:010d} 00000 n \n')
+        self._write(''.join(lines).encode('latin-1'))
+        self._write(f'trailer\n<< /Size {len(self._offsets)} /Root {catalog_id} 0 R >>\n'
+                    f'startxref\n{xref_pos}\n%%EOF\n'.encode('latin-1'))
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None: self.close()
+        else: self.abort()
+        return False
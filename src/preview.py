@@ -0,0 +1,263 @@
+"""
+界面内嵌的实时预览
+
+以屏幕分辨率渲染当前参数下的某一页，直接复用 generator.py 的排版与绘图代码。
+参数变化经过防抖后才重绘，并且只重绘变化的部分 (见 PagePainter):
+    - 版式 (纸张、行列、格子大小、网格样式与颜色、字体) 变化时才重建网格背景并整体重绘画布
+    - 其余情况不再整体重绘: 从缓存的位图恢复背景，只重画内容变化的格子
+    - 标题与页脚每次重绘 (开销很小)
+
+本模块不在导入时加载 matplotlib: 界面先显示，绘图引擎在后台加载完成后通过 attach() 接入，
+之前只显示提示文字
+"""
+import itertools
+import math
+import tkinter as tk
+
+
+class PagePainter:
+    """
+    预览页面的增量绘制，与 RasterPageWriter 相同用 copy_from_bbox / restore_region 复用位图。
+    画布整体重绘时只画网格背景 (格子内容、辅助线与文字都不在坐标轴上，辅助线设为 animated)，
+    随后在 draw_event 中保存两份位图:
+        _background  网格背景
+        _layer       背景 + 本页格子内容 + 辅助线
+    之后每次 paint 只在位图上操作:
+        - 格子没变: 恢复 _layer，重画标题与页脚
+        - 少数格子变化 (如输入一个字): 从 _background 恢复这些格子的区域，只重画这些格子
+        - 多数格子变化 (翻页、换练习模式): 恢复 _background，重画整页格子
+    不依赖 Tk，基准测试直接用 Agg 画布驱动
+    """
+    # 变化的格子超过该比例时整页重画，比逐格恢复更快
+    FULL_REDRAW_RATIO = 0.5
+
+    def __init__(self, generator, fig):
+        self.generator = generator
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.ax = fig.add_subplot()
+        self._bg_key = None
+        self._guides = None
+        self._background = None
+        self._layer = None
+        self._cells = None   # _layer 中已画的 (练习模式, grid_map)
+        self._page = None    # 最近一次 paint 的 (config, params, template, grid_map, page_num)
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def paint(self, config, params, template, grid_map, page_num):
+        """
+        绘制一页并推送到屏幕，返回本次重画的格子数
+        """
+        from generator import PageTemplate
+        self._page = (config, params, template, grid_map, page_num)
+        bg_key = (PageTemplate.key_of(config, params), config['width'], config['height'])
+        if bg_key != self._bg_key:
+            ax = self.ax
+            ax.clear()
+            ax.axis('off')
+            ax.set_xlim(0, config['width'])
+            ax.set_ylim(0, config['height'])
+            _, self._guides = template.draw(ax)
+            # 辅助线压在笔画之上，不进背景，随格子内容一起画
+            if self._guides is not None: self._guides.set_animated(True)
+            self._bg_key = bg_key
+            # 整体重绘，_on_draw 保存背景并画出整页
+            self.canvas.draw()
+            return config['rows'] * config['cols']
+        redrawn = self._paint_cells()
+        self._paint_text()
+        self.canvas.blit(self.fig.bbox)
+        return redrawn
+
+    def _on_draw(self, event):
+        # 首次绘制、版式变化或画布尺寸变化后的整体重绘: 原有位图全部失效
+        self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._layer = None
+        self._cells = None
+        if self._page is None: return
+        self._paint_cells()
+        self._paint_text()
+
+    def _paint_cells(self):
+        config, params, template, grid_map, _ = self._page
+        cells = (params.get('practice_mode'), grid_map)
+        if cells == self._cells:
+            self.canvas.restore_region(self._layer)
+            return 0
+
+        changed = self._changed_cells(self._cells, cells)
+        if changed is None or len(changed) > self.FULL_REDRAW_RATIO * config['rows'] * config['cols']:
+            self.canvas.restore_region(self._background)
+            self._draw_layer(grid_map)
+            redrawn = config['rows'] * config['cols']
+        else:
+            self.canvas.restore_region(self._layer)
+            height = self.canvas.get_width_height()[1]
+            for r, c in changed:
+                x0, y0, x1, y1 = self._cell_box(template, r, c)
+                # restore_region 的 bbox 按位图行序 (原点在左上)，xy 为位图原点的位置
+                self.canvas.restore_region(self._background, bbox=(x0, height - y1, x1, height - y0), xy=(0, 0))
+            partial = [[cell if (r, c) in changed else None for c, cell in enumerate(row)]
+                       for r, row in enumerate(grid_map)]
+            self._draw_layer(partial, changed)
+            redrawn = len(changed)
+        self._layer = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._cells = cells
+        return redrawn
+
+    @staticmethod
+    def _changed_cells(old, new):
+        """
+        两次绘制之间内容不同的格子 {(行, 列)}；练习模式或行列数变了返回 None (整页重画)
+        """
+        if old is None or old[0] != new[0] or len(old[1]) != len(new[1]): return None
+        changed = set()
+        for r, (old_row, new_row) in enumerate(zip(old[1], new[1])):
+            if len(old_row) != len(new_row): return None
+            changed.update((r, c) for c, (a, b) in enumerate(zip(old_row, new_row)) if a != b)
+        return changed
+
+    def _cell_box(self, template, r, c):
+        # 格子在画布上的像素范围 (原点在左下)
+        x, y, size = template.cell_x[c], template.cell_y[r], template.cell_size
+        (x0, y0), (x1, y1) = self.ax.transData.transform([(x, y), (x + size, y + size)])
+        return math.floor(x0), math.floor(y0), math.ceil(x1), math.ceil(y1)
+
+    def _draw_layer(self, grid_map, changed=None):
+        """
+        在当前位图上画出 grid_map 中的格子与辅助线，画完即从坐标轴移除。
+        changed 不为 None 时只画这些格子的辅助线 (其余格子的辅助线已在位图上)
+        """
+        config, params, template, _, _ = self._page
+        ax = self.ax
+        before = set(ax.get_children())
+        self.generator.draw_page_cells(ax, config, params, template, grid_map, glyph_paths=True)
+        artists = [a for a in ax.get_children() if a not in before]
+        guides = self._guides
+        if guides is not None and changed is not None:
+            from matplotlib.collections import LineCollection
+            # 辅助线段按格子行优先排列，每格条数相同
+            per_cell = len(template.guide_segs) // (config['rows'] * config['cols'])
+            index = [(r * config['cols'] + c) * per_cell + k for r, c in sorted(changed) for k in range(per_cell)]
+            subset = LineCollection(template.guide_segs[index])
+            subset.update_from(guides)
+            subset.set_zorder(guides.get_zorder())
+            guides = subset
+        layer = artists + [guides] if guides is not None else artists
+        # 与 Axes.draw 相同: 按 zorder 稳定排序
+        for artist in sorted(layer, key=lambda a: a.get_zorder()):
+            ax.draw_artist(artist)
+        for artist in artists:
+            artist.remove()
+
+    def _paint_text(self):
+        config, params, template, _, page_num = self._page
+        ax = self.ax
+        before = set(ax.get_children())
+        self.generator.draw_page_text(ax, config, params, template, page_num)
+        for artist in [a for a in ax.get_children() if a not in before]:
+            ax.draw_artist(artist)
+            artist.remove()
+
+
+class PreviewPane(tk.LabelFrame):
+    PREVIEW_DPI = 50
+    DEBOUNCE_MS = 250
+
+    def __init__(self, master, generator, get_params, **kw):
+        super().__init__(master, text="实时预览", padx=5, pady=5, **kw)
+        self.generator = generator   # 为 None 时等待 attach()
+        self.get_params = get_params
+        self.page_index = 0
+        self.active = True           # 预览收起时为 False，不刷新
+        self._after_id = None
+
+        self._fig = None
+        self._canvas = None
+        self._painter = None
+        self._size = None
+
+        f_nav = tk.Frame(self)
+        f_nav.pack(side="bottom", fill="x", pady=(5, 0))
+        self.btn_prev = tk.Button(f_nav, text="上一页", width=6, command=lambda: self.goto(-1))
+        self.btn_prev.pack(side="left")
+        self.lbl_page = tk.Label(f_nav, text="", fg="gray")
+        self.lbl_page.pack(side="left", expand=True)
+        self.btn_next = tk.Button(f_nav, text="下一页", width=6, command=lambda: self.goto(1))
+        self.btn_next.pack(side="right")
+
+        self.lbl_loading = tk.Label(self, text="正在加载绘图引擎...", fg="gray")
+        if generator is None: self.lbl_loading.pack(side="top", expand=True)
+
+    def attach(self, generator):
+        """
+        绘图引擎加载完成后接入生成器，并立即刷新一次
+        """
+        self.generator = generator
+        self.lbl_loading.pack_forget()
+        self.schedule()
+
+    def schedule(self, *args):
+        """
+        参数变化时调用: 防抖，停止输入一小段时间后才重绘
+        """
+        if not self.active: return
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+        self._after_id = self.after(self.DEBOUNCE_MS, self.refresh)
+
+    def set_active(self, active):
+        """
+        预览收起时停止刷新，重新显示时按当前参数刷新一次
+        """
+        self.active = active
+        if active:
+            self.schedule()
+        elif self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+
+    def goto(self, delta):
+        self.page_index = max(0, self.page_index + delta)
+        self.refresh()
+
+    def refresh(self):
+        self._after_id = None
+        if self.generator is None or not self.active: return
+        params = self.get_params()
+        if params is None: return
+
+        gen = self.generator
+        config = gen.get_layout_config(params)
+        if params.get('practice_mode') == "笔顺分解": gen.stroke_mgr.load_data()
+
+        # 只排版到目标页的下一页为止，长文本也不会整篇排版
+        plans = list(itertools.islice(gen.layout_pages(params, config), self.page_index, self.page_index + 2))
+        if not plans:
+            self.page_index = 0
+            plans = list(itertools.islice(gen.layout_pages(params, config), 0, 2))
+        grid_map = plans[0]
+        page_num = self.page_index + 1
+
+        self._ensure_figure(config)
+        self._painter.paint(config, params, gen.get_page_template(config, params), grid_map, page_num)
+        self.lbl_page.config(text=f"第 {page_num} 页")
+        self.btn_prev.config(state="normal" if self.page_index > 0 else "disabled")
+        self.btn_next.config(state="normal" if len(plans) > 1 else "disabled")
+
+    def _ensure_figure(self, config):
+        # 与上次创建时的纸张尺寸比较: Tk 调整控件大小时会改写 Figure 的英寸尺寸，不能用它判断
+        size = (config['width'], config['height'])
+        if self._fig is not None and self._size == size:
+            return
+        # 第一次绘制时才导入 (此时 generator 已在后台加载了 matplotlib)
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        if self._canvas is not None:
+            self._canvas.get_tk_widget().destroy()
+        # 与输出使用相同的英寸尺寸和坐标轴布局，只降低分辨率
+        self._fig = Figure(figsize=size, dpi=self.PREVIEW_DPI)
+        self._canvas = FigureCanvasTkAgg(self._fig, master=self)
+        self._canvas.get_tk_widget().pack(side="top", fill="both", expand=True)
+        self._painter = PagePainter(self.generator, self._fig)
+        self._size = size
@@ -0,0 +1,365 @@
+"""
+本地 HTTP 字帖生成服务
+
+常驻的工作进程各自只加载一次笔顺数据与字体，请求经有界队列分派给它们；
+队列已满时立即返回 503 (附 Retry-After)，不会无限堆积。只依赖标准库，不连接任何外部服务。
+
+    python src/cli.py serve --port 8000 --workers 2 --queue 8
+
+接口:
+    POST /generate  请求体为 generate_pdf 的 params JSON，未给出的项取 DEFAULT_PARAMS，
+                    返回生成的文件 (output_format 为 pdf / tiff，单页模式下也可为 png)
+    GET  /metrics   请求计数、延迟分位数、吞吐量与队列状态 (JSON)
+    GET  /health    服务存活检查
+
+为安全起见，请求中的 output_file、text_file 会被忽略，font_path 只取文件名并在 resources 目录下查找。
+参数值的类型须与 DEFAULT_PARAMS 一致 (数值与布尔项也可写成字符串)，grid_color 须为 GRID_COLORS 中的颜色名 (或其色值)，
+pdf_fonttype 须为 3 或 42，否则返回 400；
+raster_dpi 与自定义网格的行列数会被限制在 MAX_RASTER_DPI、MAX_CUSTOM_CELLS 以内，避免单个请求耗尽工作进程的内存。
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from generator import CopybookGenerator, FONT_REGISTRY, DEFAULT_PARAMS, GRID_COLORS, PDF_FONTTYPES, output_format_of
+from cli import build_params
+
+CONTENT_TYPES = {'pdf': 'application/pdf', 'tiff': 'image/tiff', 'png': 'image/png'}
+MAX_BODY_BYTES = 8 * 1024 * 1024
+# A4 600 dpi 的整页画布约 140 MB (RGBA)
+MAX_RASTER_DPI = 600
+MAX_CUSTOM_CELLS = 50
+
+
+def _check_types(job):
+    """
+    请求中的值须与 DEFAULT_PARAMS 中同名项的类型一致，否则抛出 ValueError。
+    字符串一律放行 (数值、布尔项由 build_params 转换，转换失败同样是 ValueError)；不认识的键不检查
+    """
+    for key, value in job.items():
+        default = DEFAULT_PARAMS.get(key)
+        if value is None or default is None or isinstance(value, str): continue
+        if isinstance(default, bool): ok = isinstance(value, bool)
+        elif isinstance(default, int): ok = isinstance(value, int) and not isinstance(value, bool)
+        elif isinstance(default, float): ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+        else: ok = False
+        if not ok:
+            raise ValueError(f"{key} 应为 {type(default).__name__}，收到 {type(value).__name__}")
+
+
+# ==========================================
+# 工作进程
+# ==========================================
+_service_generator = None
+
+def _init_service_worker(stroke_cache_size):
+    # 进程启动时加载一次笔顺数据与默认字体，之后的请求直接复用
+    global _service_generator
+    _service_generator = CopybookGenerator(stroke_cache_size=stroke_cache_size)
+    _service_generator.stroke_mgr.load_data()
+    FONT_REGISTRY.get(_service_generator.default_font_path())
+
+def _warm_up():
+    return os.getpid()
+
+def _service_job(params):
+    """
+    在工作进程中生成一份字帖，返回 (文件内容, 生成耗时)
+    """
+    fd, path = tempfile.mkstemp(prefix='copybook-', suffix='.' + params['output_format'])
+    os.close(fd)
+    try:
+        start = time.perf_counter()
+        _service_generator.generate_pdf(dict(params, output_file=path))
+        seconds = time.perf_counter() - start
+        with open(path, 'rb') as f:
+            return f.read(), seconds
+    finally:
+        try: os.remove(path)
+        except OSError: pass
+
+
+# ==========================================
+# 指标
+# ==========================================
+def _percentile(sorted_values, q):
+    if not sorted_values: return None
+    i = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return round(sorted_values[i], 4)
+
+
+class ServiceMetrics:
+    """
+    请求计数与最近 window 个成功请求的延迟 (总耗时含排队，以及工作进程内的生成耗时)；
+    吞吐量按最近 60 秒完成的请求数计算
+    """
+    def __init__(self, window=1000):
+        self.started = time.time()
+        self.requests = 0
+        self.status_counts = {}
+        self.completed = 0
+        self.rejected = 0
+        self._latency = deque(maxlen=window)
+        self._generate = deque(maxlen=window)
+        self._done_times = deque()
+        self._lock = threading.Lock()
+
+    def record(self, status, total_seconds=None, generate_seconds=None):
+        with self._lock:
+            self.requests += 1
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            if status == 503: self.rejected += 1
+            if status == 200:
+                now = time.time()
+                self.completed += 1
+                self._latency.append(total_seconds)
+                self._generate.append(generate_seconds)
+                self._done_times.append(now)
+                while self._done_times and self._done_times[0] < now - 60:
+                    self._done_times.popleft()
+
+    def snapshot(self):
+        with self._lock:
+            now = time.time()
+            while self._done_times and self._done_times[0] < now - 60:
+                self._done_times.popleft()
+            latency = sorted(self._latency)
+            generate = sorted(self._generate)
+            uptime = now - self.started
+            return {
+                "uptime_seconds": round(uptime, 1),
+                "requests": self.requests,
+                "status": {str(k): v for k, v in sorted(self.status_counts.items())},
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "jobs_per_minute_last_60s": len(self._done_times),
+                "jobs_per_minute_overall": round(self.completed / uptime * 60, 2) if uptime > 0 else 0.0,
+                "latency_seconds": {"p50": _percentile(latency, 0.5), "p90": _percentile(latency, 0.9),
+                                    "p99": _percentile(latency, 0.99), "max": round(latency[-1], 4) if latency else None},
+                "generate_seconds": {"p50": _percentile(generate, 0.5), "p90": _percentile(generate, 0.9),
+                                     "p99": _percentile(generate, 0.99)},
+            }
+
+
+# ==========================================
+# 服务
+# ==========================================
+class ServiceBusy(Exception):
+    pass
+
+
+class GenerationService:
+    """
+    工作进程池 + 有界队列。同时受理的请求最多 workers + queue_size 个 (正在生成的加排队的)，
+    超出时 submit 抛出 ServiceBusy
+    """
+    def __init__(self, workers=2, queue_size=8, timeout=120, stroke_cache_size=256):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.stroke_cache_size = stroke_cache_size
+        self.generator = CopybookGenerator()   # 只用于补全参数，不在服务进程中绘图
+        self.metrics = ServiceMetrics()
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._replacing = False
+        self._pool = self._new_pool()
+
+    def _new_pool(self):
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_service_worker,
+                                   initargs=(self.stroke_cache_size,))
+        # 进程按需启动，这里先提交与进程数相同的空任务，让所有工作进程在第一个请求之前就绪
+        for future in [pool.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+        return pool
+
+    def _replace_pool(self, broken):
+        """
+        关闭损坏的进程池并换上新的。新进程池的启动与预热要几秒，不持锁进行，
+        期间其他请求仍取到旧池并立即失败；多个请求同时发现损坏时只重建一次
+        """
+        with self._lock:
+            if self._pool is not broken or self._replacing: return
+            self._replacing = True
+        broken.shutdown(wait=False, cancel_futures=True)
+        try:
+            pool = self._new_pool()
+        except BaseException:
+            with self._lock:
+                self._replacing = False
+            raise
+        with self._lock:
+            self._pool = pool
+            self._replacing = False
+
+    def prepare(self, job):
+        """
+        请求中的参数 -> generate_pdf 的 params；类型不符或不支持的输出格式抛出 ValueError
+        """
+        job = {k: v for k, v in job.items() if k not in ('output_file', 'text_file')}
+        _check_types(job)
+        if job.get('font_path'):
+            job['font_path'] = os.path.join(self.generator.resource_dir, os.path.basename(job['font_path']))
+        params = build_params(job, self.generator)
+        fmt = output_format_of(params)
+        if fmt not in CONTENT_TYPES:
+            raise ValueError(f"不支持的输出格式: {fmt}")
+        if fmt == 'png' and params['is_multipage']:
+            raise ValueError("多页模式每页一个 PNG 文件，请改用 pdf 或 tiff")
+        # 这两项的取值范围 build_params 不检查，错误的值要到工作进程里绘图时才失败 (500)
+        if params['grid_color'] not in GRID_COLORS.values():
+            raise ValueError(f"grid_color 只能是 {', '.join(GRID_COLORS)}，收到 {job.get('grid_color')!r}")
+        if params['pdf_fonttype'] not in PDF_FONTTYPES:
+            raise ValueError(f"pdf_fonttype 只能是 {PDF_FONTTYPES}，收到 {params['pdf_fonttype']!r}")
+        # 并行已经在请求之间进行，单个请求内不再开进程池
+        params.update(output_format=fmt, workers=1)
+        # 画布大小与格子数随这几项增长，超出上限的值按上限处理
+        params['raster_dpi'] = min(max(params['raster_dpi'], 1), MAX_RASTER_DPI)
+        for key in ('custom_rows', 'custom_cols'):
+            params[key] = min(max(params[key], 1), MAX_CUSTOM_CELLS)
+        return params
+
+    def submit(self, params):
+        """
+        排队生成，返回 (文件内容, 生成耗时)；超时抛出 FuturesTimeout
+        """
+        if not self._slots.acquire(blocking=False):
+            raise ServiceBusy()
+        with self._lock:
+            self._pending += 1
+        try:
+            with self._lock:
+                pool = self._pool
+            future = pool.submit(_service_job, params)
+        except BaseException:
+            self._release()
+            raise
+        # 名额在任务真正结束时才归还，超时返回给客户端的任务仍占用工作进程
+        future.add_done_callback(lambda f: self._release())
+        try:
+            return future.result(timeout=self.timeout)
+        except BrokenProcessPool:
+            # 工作进程异常退出 (如内存不足被杀)，重建进程池后再报告失败
+            self._replace_pool(pool)
+            raise
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def status(self):
+        with self._lock:
+            pending = self._pending
+        return dict(self.metrics.snapshot(), workers=self.workers, queue_size=self.queue_size,
+                    in_flight=min(pending, self.workers), queued=max(0, pending - self.workers))
+
+    def shutdown(self):
+        with self._lock:
+            pool = self._pool
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "CopybookService/1.0"
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/metrics':
+            self._send_json(200, service.status())
+        elif self.path == '/health':
+            self._send_json(200, {"ok": True})
+        else:
+            self._send_json(404, {"error": "未知路径"})
+
+    def do_POST(self):
+        service = self.server.service
+        if self.path != '/generate':
+            self._send_json(404, {"error": "未知路径"})
+            return
+        start = time.perf_counter()
+        status, generate_seconds = self._generate(service)
+        service.metrics.record(status, time.perf_counter() - start, generate_seconds)
+
+    def _generate(self, service):
+        """
+        处理一次生成请求，返回 (状态码, 生成耗时)
+        """
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > MAX_BODY_BYTES:
+                self._send_json(413, {"error": "请求体过大"})
+                return 413, None
+            job = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(job, dict): raise ValueError("请求体应为 JSON 对象")
+            params = service.prepare(job)
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {"error": f"参数无效: {e}"})
+            return 400, None
+        except Exception as e:
+            # 补全参数时的意外错误也要回应客户端并计入指标，不让处理线程带着异常退出
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return 500, None
+
+        try:
+            data, seconds = service.submit(params)
+        except ServiceBusy:
+            self._send_json(503, {"error": "队列已满，请稍后重试"}, {'Retry-After': '5'})
+            return 503, None
+        except FuturesTimeout:
+            self._send_json(504, {"error": f"生成超时 ({service.timeout}s)"})
+            return 504, None
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return 500, None
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[params['output_format']])
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-Generate-Seconds', f"{seconds:.4f}")
+        self.end_headers()
+        self.wfile.write(data)
+        return 200, seconds
+
+
+def make_server(host='127.0.0.1', port=8000, workers=2, queue_size=8, timeout=120):
+    """
+    创建服务 (工作进程已就绪)，调用方负责 serve_forever() 与 shutdown
+    """
+    service = GenerationService(workers, queue_size, timeout)
+    httpd = ThreadingHTTPServer((host, port), _Handler)
+    httpd.daemon_threads = True
+    httpd.service = service
+    return httpd
+
+
+def serve(host='127.0.0.1', port=8000, workers=2, queue_size=8, timeout=120):
+    httpd = make_server(host, port, workers, queue_size, timeout)
+    print(f"字帖生成服务已启动: http://{host}:{httpd.server_address[1]}  "
+          f"(工作进程 {workers} 个，队列 {queue_size})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        httpd.service.shutdown()
@@ -0,0 +1,175 @@
+"""
+笔顺数据编译库 (strokes.bin)
+
+将 MakeMeHanzi 的 strokes.txt (每行一个 JSON) 一次性编译为带索引的二进制文件，
+运行时通过 mmap 打开，按字符做 O(1) 查找，无需把整个数据集解析进内存。
+
+文件结构 (小端):
+    头部   : magic(8s) version(I) count(I) slots(I) data_offset(I)
+    索引表 : slots 个槽位，每个槽位 codepoint(I) offset(I) length(I)，codepoint=0 表示空槽
+    数据区 : 每个字一条记录: 包围盒 x0(d) y0(d) x1(d) y1(d)，其后为笔画 SVG 字符串以 '\\n' 连接后的 UTF-8 字节
+             (无法预先计算包围盒时为 NaN，由运行时解析路径后计算)
+
+用法:
+    python src/stroke_store.py [resources 目录]
+"""
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import struct
+
+STORE_MAGIC = b'HZSTROKE'
+STORE_VERSION = 3
+STORE_FILENAME = 'strokes.bin'
+
+_HEADER = struct.Struct('<8sIIII')
+_SLOT = struct.Struct('<III')
+_BBOX = struct.Struct('<dddd')
+
+_SVG_NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_SVG_COMMAND = re.compile(r'[A-DF-Za-df-z]')
+
+
+def _slot_of(codepoint, mask):
+    # Knuth 乘法散列，线性探测
+    return (codepoint * 2654435761) & mask
+
+
+def stroke_bbox(strokes):
+    """
+    全部笔画控制点的包围盒 (x0, y0, x1, y1)，与解析后各 Path.vertices 的范围一致。
+    只处理 MakeMeHanzi 使用的绝对坐标命令 (M L Q C Z，坐标成对出现)，
+    含其他命令或没有坐标时返回 None
+    """
+    joined = ' '.join(strokes)
+    if not set(_SVG_COMMAND.findall(joined)) <= set('MLQCZ'): return None
+    nums = [float(v) for v in _SVG_NUMBER.findall(joined)]
+    if not nums or len(nums) % 2: return None
+    xs, ys = nums[0::2], nums[1::2]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def build_stroke_store(txt_path, store_path):
+    """
+    从 strokes.txt 编译二进制笔顺库，返回收录的字数
+    """
+    entries = {}
+    with open(txt_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                char = entry['character']
+                if len(char) != 1: continue
+                # 包围盒在编译时算好，运行时取字的几何不必再遍历全部顶点
+                bbox = stroke_bbox(entry['strokes']) or (math.nan,) * 4
+                entries[ord(char)] = _BBOX.pack(*bbox) + '\n'.join(entry['strokes']).encode('utf-8')
+            except (ValueError, KeyError, TypeError): continue
+
+    # 槽位数取不小于 2 倍字数的 2 的幂，保证探测链很短
+    slots = 1
+    while slots < len(entries) * 2: slots <<= 1
+    mask = slots - 1
+
+    table = [(0, 0, 0)] * slots
+    blobs = []
+    data_offset = _HEADER.size + slots * _SLOT.size
+    offset = data_offset
+    for cp, blob in entries.items():
+        i = _slot_of(cp, mask)
+        while table[i][0] != 0:
+            i = (i + 1) & mask
+        table[i] = (cp, offset, len(blob))
+        blobs.append(blob)
+        offset += len(blob)
+
+    # 先写临时文件再替换，避免其他进程读到半成品
+    tmp_path = store_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(STORE_MAGIC, STORE_VERSION, len(entries), slots, data_offset))
+        f.write(b''.join(_SLOT.pack(*slot) for slot in table))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, store_path)
+    return len(entries)
+
+
+class CompiledStrokeStore:
+    """
+    只读的 mmap 笔顺库，get() 按需解码单个字的笔画
+    """
+    def __init__(self, store_path):
+        self.path = store_path
+        self._file = open(store_path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._file.close()
+            raise
+        magic, version, count, slots, data_offset = _HEADER.unpack_from(self._mm, 0)
+        if magic != STORE_MAGIC or slots & (slots - 1):
+            self.close()
+            raise ValueError(f"不是有效的笔顺库文件: {store_path}")
+        if version != STORE_VERSION:
+            self.close()
+            raise ValueError(f"笔顺库格式 (版本 {version}) 已过期，请运行 python src/stroke_store.py 重新编译")
+        self.count = count
+        self._slots = slots
+        self._mask = slots - 1
+
+    def _find(self, char):
+        if len(char) != 1: return None
+        cp = ord(char)
+        i = _slot_of(cp, self._mask)
+        for _ in range(self._slots):
+            slot_cp, offset, length = _SLOT.unpack_from(self._mm, _HEADER.size + i * _SLOT.size)
+            if slot_cp == cp: return offset, length
+            if slot_cp == 0: return None
+            i = (i + 1) & self._mask
+        return None
+
+    def get(self, char):
+        found = self._find(char)
+        if found is None: return None
+        offset, length = found
+        if length == _BBOX.size: return []
+        return self._mm[offset + _BBOX.size:offset + length].decode('utf-8').split('\n')
+
+    def bbox(self, char):
+        """
+        编译时算好的包围盒 (x0, y0, x1, y1)，字不存在或未能预先计算时返回 None
+        """
+        found = self._find(char)
+        if found is None: return None
+        bbox = _BBOX.unpack_from(self._mm, found[0])
+        if math.isnan(bbox[0]): return None
+        return bbox
+
+    def __contains__(self, char):
+        return self._find(char) is not None
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if getattr(self, '_mm', None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        resource_dir = sys.argv[1]
+    else:
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        resource_dir = os.path.join(os.path.dirname(current_dir), 'resources')
+    txt_path = os.path.join(resource_dir, 'strokes.txt')
+    store_path = os.path.join(resource_dir, STORE_FILENAME)
+    if not os.path.exists(txt_path):
+        print(f"未找到笔顺数据: {txt_path}")
+        sys.exit(1)
+    n = build_stroke_store(txt_path, store_path)
+    print(f"已编译 {n} 个字 -> {store_path} ({os.path.getsize(store_path) / 1024 / 1024:.1f} MB)")